@@ -0,0 +1,182 @@
+"""Eviction policies of the rack image caches. A policy decides which cached image leaves the rack when a new image
+does not fit. It works on the rack document: per image data lives in the entries of rack["ImageCache"] and any
+other policy data in rack["CacheState"], so the state is stored together with the cache itself.
+
+LRU   evicts the image used least recently (Timestamp).
+LFU   evicts the image used least often (Hits), the least recent one among equals.
+GDS   GreedyDual-Size. Evicts the image with the lowest Priority = L + 1 / Size, where L is the priority of the last
+      evicted image. Small images are cheap to keep and large cold ones leave first, while L ages out images that
+      are not used anymore.
+ARC   Adaptive Replacement Cache, measured in bytes. Splits the cache between images seen once (T1) and images seen
+      again (T2) and adapts the split with the ghost lists B1 and B2 of recently evicted names, so a hot large image
+      is not pushed out by a stream of one time images.
+"""
+
+
+class CachePolicy:
+    name = None
+
+    # Called when the cached entry is requested again
+    def hit(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+
+    # Called after entry was added to rack["ImageCache"]
+    def insert(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+
+    # Returns the cached entry to evict to make room for image
+    def victim(self, rack, image):
+        raise NotImplementedError
+
+    # Called after entry was removed from rack["ImageCache"]
+    def evicted(self, rack, entry):
+        pass
+
+
+class LRUPolicy(CachePolicy):
+    name = "LRU"
+
+    # Moves the entry to the end so the cache stays in order of use
+    def hit(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        rack["ImageCache"].remove(entry)
+        rack["ImageCache"].append(entry)
+
+    def victim(self, rack, image):
+        return min(rack["ImageCache"], key=lambda entry: entry["Timestamp"])
+
+
+class LFUPolicy(CachePolicy):
+    name = "LFU"
+
+    def hit(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        entry["Hits"] = entry.get("Hits", 1) + 1
+
+    def insert(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        entry["Hits"] = 1
+
+    def victim(self, rack, image):
+        return min(rack["ImageCache"], key=lambda entry: (entry.get("Hits", 1), entry["Timestamp"]))
+
+
+class GreedyDualSizePolicy(CachePolicy):
+    name = "GDS"
+
+    @staticmethod
+    def _priority(rack, entry):
+        return rack.setdefault("CacheState", dict()).get("L", 0.0) + 1.0 / max(entry["Size"], 1)
+
+    def hit(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        entry["Priority"] = GreedyDualSizePolicy._priority(rack, entry)
+
+    def insert(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        entry["Priority"] = GreedyDualSizePolicy._priority(rack, entry)
+
+    def victim(self, rack, image):
+        return min(rack["ImageCache"], key=lambda entry: (entry.get("Priority", 0.0), entry["Timestamp"]))
+
+    # The evicted priority becomes the new base, which ages every image still cached
+    def evicted(self, rack, entry):
+        rack.setdefault("CacheState", dict())["L"] = entry.get("Priority", 0.0)
+
+
+class ARCPolicy(CachePolicy):
+    name = "ARC"
+
+    # Returns the ARC lists of the rack. Cached images the lists do not know about, for example after switching
+    # policy, are treated as seen once and least recent
+    @staticmethod
+    def _state(rack):
+        state = rack.setdefault("CacheState", dict())
+        for key in ("T1", "T2", "B1", "B2"):
+            state.setdefault(key, [])
+        state.setdefault("P", 0)
+        cached = set(entry["Name"] for entry in rack["ImageCache"])
+        state["T1"] = [name for name in state["T1"] if name in cached]
+        state["T2"] = [name for name in state["T2"] if name in cached]
+        known = set(state["T1"]) | set(state["T2"])
+        state["T1"][:0] = [entry["Name"] for entry in sorted(rack["ImageCache"], key=lambda e: e["Timestamp"])
+                           if entry["Name"] not in known]
+        return state
+
+    @staticmethod
+    def _bytes(ghosts):
+        return sum(size for name, size in ghosts)
+
+    @staticmethod
+    def _size(rack, names):
+        sizes = dict((entry["Name"], entry["Size"]) for entry in rack["ImageCache"])
+        return sum(sizes[name] for name in names)
+
+    def hit(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        state = ARCPolicy._state(rack)
+        if entry["Name"] in state["T1"]:
+            state["T1"].remove(entry["Name"])
+        else:
+            state["T2"].remove(entry["Name"])
+        state["T2"].append(entry["Name"])
+
+    # Adapts the T1 target P when the image was evicted recently, then puts it in T2 if it was, T1 otherwise
+    def insert(self, rack, entry, timestamp):
+        entry["Timestamp"] = timestamp
+        state = ARCPolicy._state(rack)
+        name, size = entry["Name"], entry["Size"]
+        state["T1"].remove(name)
+        b1 = [ghost for ghost in state["B1"] if ghost[0] != name]
+        b2 = [ghost for ghost in state["B2"] if ghost[0] != name]
+        if len(b1) < len(state["B1"]):
+            delta = max(1.0, float(ARCPolicy._bytes(b2)) / max(ARCPolicy._bytes(b1), 1)) * size
+            state["P"] = min(rack["Capacity"], state["P"] + delta)
+            state["T2"].append(name)
+        elif len(b2) < len(state["B2"]):
+            delta = max(1.0, float(ARCPolicy._bytes(b1)) / max(ARCPolicy._bytes(b2), 1)) * size
+            state["P"] = max(0, state["P"] - delta)
+            state["T2"].append(name)
+        else:
+            state["T1"].append(name)
+        state["B1"], state["B2"] = b1, b2
+        ARCPolicy._trim_ghosts(rack, state)
+
+    # Evicts from T1 while it is above its target P, from T2 otherwise
+    def victim(self, rack, image):
+        state = ARCPolicy._state(rack)
+        t1_bytes = ARCPolicy._size(rack, state["T1"])
+        in_b2 = any(ghost[0] == image["Name"] for ghost in state["B2"])
+        if state["T1"] and (t1_bytes > state["P"] or (in_b2 and t1_bytes == state["P"]) or not state["T2"]):
+            name = state["T1"][0]
+        else:
+            name = state["T2"][0]
+        return next(entry for entry in rack["ImageCache"] if entry["Name"] == name)
+
+    def evicted(self, rack, entry):
+        state = rack["CacheState"]
+        if entry["Name"] in state["T1"]:
+            state["T1"].remove(entry["Name"])
+            state["B1"].append([entry["Name"], entry["Size"]])
+        elif entry["Name"] in state["T2"]:
+            state["T2"].remove(entry["Name"])
+            state["B2"].append([entry["Name"], entry["Size"]])
+        ARCPolicy._trim_ghosts(rack, state)
+
+    # Keeps T1 + B1 within the capacity and all four lists within twice the capacity
+    @staticmethod
+    def _trim_ghosts(rack, state):
+        capacity = rack["Capacity"]
+        t1_bytes = ARCPolicy._size(rack, state["T1"])
+        t2_bytes = ARCPolicy._size(rack, state["T2"])
+        while state["B1"] and t1_bytes + ARCPolicy._bytes(state["B1"]) > capacity:
+            state["B1"].pop(0)
+        while state["B2"] and t1_bytes + t2_bytes + ARCPolicy._bytes(state["B1"]) + \
+                ARCPolicy._bytes(state["B2"]) > 2 * capacity:
+            state["B2"].pop(0)
+
+
+# Policy used by racks that never selected one
+DEFAULT_POLICY = LRUPolicy.name
+
+POLICIES = dict((policy.name, policy) for policy in (LRUPolicy(), LFUPolicy(), GreedyDualSizePolicy(), ARCPolicy()))
@@ -0,0 +1,54 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Free memory, disk and vcpu of many servers held side by side, to answer capacity questions for the whole data
+# center at once. With NumPy installed the capacities are one (servers x 3) integer array and every question is a
+# vectorized operation over it. Without NumPy the same answers are computed with plain lists, so NumPy stays optional.
+# Placing instances one at a time is left to PlacementIndex, which finds the best fit without looking at every server.
+class CapacityModel:
+
+    def __init__(self, servers):
+        servers = [server for server in servers if server.get("isActive", True)]
+        self.names = [server["Name"] for server in servers]
+        rows = [(server["Memory_free"], server["disk_free"], server["VCPU_free"]) for server in servers]
+        if numpy is not None:
+            self.free = numpy.array(rows, dtype=numpy.int64).reshape(len(rows), 3)
+        else:
+            self.free = [list(row) for row in rows]
+
+    def __len__(self):
+        return len(self.names)
+
+    # Returns the (memory, disk, vcpu) demand of the flavor documents as rows
+    @staticmethod
+    def demands(flavors):
+        return [(flavor["Memory"], flavor["Disk"], flavor["VCPU"]) for flavor in flavors]
+
+    # Returns, for every flavor, how many more instances of it the servers can host if only that flavor is placed,
+    # and on how many servers at least one fits. The count is None for a flavor that needs no resources
+    def headroom(self, flavors):
+        demands = CapacityModel.demands(flavors)
+        result = self._headroom(demands)
+        return [(None, len(self)) if not any(demand) else counts for demand, counts in zip(demands, result)]
+
+    def _headroom(self, demands):
+        if numpy is not None:
+            need = numpy.array(demands, dtype=numpy.int64).reshape(len(demands), 1, 3)
+            per_resource = numpy.where(need > 0, self.free[numpy.newaxis, :, :] // numpy.maximum(need, 1),
+                                       numpy.iinfo(numpy.int64).max)
+            per_server = numpy.maximum(per_resource.min(axis=2), 0)
+            return [(int(count), int(servers)) for count, servers in zip(per_server.sum(axis=1),
+                                                                         (per_server > 0).sum(axis=1))]
+        result = []
+        for demand in demands:
+            count = servers = 0
+            for row in self.free:
+                fit = min(row[i] // demand[i] if demand[i] > 0 else float("inf") for i in range(3))
+                if fit > 0:
+                    count += fit
+                    servers += 1
+            result.append((count, servers))
+        return result
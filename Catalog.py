@@ -0,0 +1,59 @@
+import time
+from storage.Backend import project
+
+# Seconds a loaded catalog is trusted before it is read again, so flavors and images changed by another process are
+# seen. Names missing from the catalog are always checked against the store
+CATALOG_TTL = 5
+
+
+# In-process copy of the flavors and images. Both are small and rarely written, so each is read whole on first use
+# and every later lookup is answered from memory. The backend drops a collection whenever it writes to it. Lookups
+# return copies, so callers may change the documents they get.
+class Catalog:
+
+    COLLECTIONS = ("Flavors", "Images")
+
+    # load is called with a collection name and returns all its documents
+    def __init__(self, load):
+        self._load = load
+        # Collection name -> (time loaded, name -> document)
+        self._collections = dict()
+
+    # Returns the name -> document dictionary of the collection, reading it if it was never read, was dropped or is
+    # older than CATALOG_TTL
+    def documents(self, collection, refresh=False):
+        loaded = self._collections.get(collection)
+        if refresh or loaded is None or time.monotonic() - loaded[0] > CATALOG_TTL:
+            loaded = (time.monotonic(), dict((doc["Name"], doc) for doc in self._load(collection)))
+            self._collections[collection] = loaded
+        return loaded[1]
+
+    # Returns a copy of the named document with only the given fields, or None if the store has no such document
+    def get(self, collection, name, fields=None):
+        doc = self._find(collection, name)
+        return dict(project(doc, fields)) if doc is not None else None
+
+    # Returns True if the store has a document with the name
+    def exists(self, collection, name):
+        return self._find(collection, name) is not None
+
+    # Returns copies of the documents of the page starting at offset with at most limit documents
+    def select(self, collection, fields=None, offset=0, limit=None):
+        documents = list(self.documents(collection).values())
+        end = None if limit is None else offset + limit
+        return [dict(project(doc, fields)) for doc in documents[offset:end]]
+
+    # Drops the cached collection, or all of them. The next lookup reads it again
+    def invalidate(self, collection=None):
+        if collection is None:
+            self._collections.clear()
+        else:
+            self._collections.pop(collection, None)
+
+    # A name missing from a catalog loaded earlier may have been added since, so the collection is read again once
+    def _find(self, collection, name):
+        fresh = collection not in self._collections
+        doc = self.documents(collection).get(name)
+        if doc is None and not fresh:
+            doc = self.documents(collection, refresh=True).get(name)
+        return doc
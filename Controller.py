@@ -4,9 +4,19 @@ from models.Instance import Instance
 from models.Rack import Rack
 from models.Server import Server
 from Validator import Validator as validator
+from Planner import Planner
+from Simulator import Simulator
+from CapacityModel import CapacityModel
+import sys
 import Exceptions as exp
 import DAO as dao
 
+# Entries of a config file written to the database at a time
+CONFIG_CHUNK_SIZE = 1000
+
+# Times a new instance looks for another server when the chosen one was taken by a concurrent command
+PLACEMENT_RETRIES = 5
+
 
 class Controller:
 
@@ -15,80 +25,200 @@ class Controller:
     def initialize_tables():
         dao.initialize()
 
+    # Initializes the database only if it was never initialized or was initialized by an older version. Costs a
+    # single read when the database is up to date
+    @staticmethod
+    def check_tables():
+        if dao.schema_version() < dao.Schema_Version:
+            dao.initialize()
+
+    # Makes the writes done so far durable. Used by long running processes that never close the connection
+    @staticmethod
+    def flush():
+        dao.flush()
+
+    # Releases the database connection pool held by this process
+    @staticmethod
+    def close_connection():
+        dao.close()
+
     # Reads image configuration from file and creates images in database
     @staticmethod
     def create_images(file_name):
         with open(file_name, "r") as f:
-            # The first line indicates how many images store
-            images_cnt = f.readline().split()
-            images_list = []
-            for i in range(int(images_cnt[0])):
-                line = f.readline().split()
-                image = Image(line[0], validator.validate_int_value(line[1]), line[2])
-                images_list.append(image)
-            dao.create_images(images_list)
+            lines = enumerate(f, 1)
+            rejected = Controller.load_section(lines, file_name, Controller.parse_image, dao.create_images)[0]
+        Controller.check_rejected(file_name, rejected)
 
     # Reads flavors configuration from file and creates flavors in database
     @staticmethod
     def create_flavors(file_name):
         with open(file_name, "r") as f:
-            # The first line indicates how many flavors store
-            flavors_cnt = f.readline().split()
-            flavors_list = []
-            for i in range(int(flavors_cnt[0])):
-                line = f.readline().split()
-                flavor = Flavor(line[0], validator.validate_int_value(line[1]),
-                                validator.validate_int_value(line[2]), validator.validate_int_value(line[3]))
-                flavors_list.append(flavor)
-            dao.create_flavors(flavors_list)
-
-    # Reads rack and machine configuration from file and creates both racks and machines in database in that order
+            lines = enumerate(f, 1)
+            rejected = Controller.load_section(lines, file_name, Controller.parse_flavor, dao.create_flavors)[0]
+        Controller.check_rejected(file_name, rejected)
+
+    # Reads rack and machine configuration from file and creates both racks and machines in database in that order.
+    # Machines are checked against the racks of the file and of the database, read once
     @staticmethod
     def create_racks_servers(file_name):
         with open(file_name, "r") as f:
-            racks_cnt = f.readline().split()
-            rack_config = []
-            for i in range(int(racks_cnt[0])):
-                line = f.readline().split()
-                rack = Rack(line[0], validator.validate_int_value(line[1]))
-                rack_config.append(rack)
-            dao.create_racks(rack_config)
-            servers_cnt = f.readline().split()
-            server_config = []
-            for i in range(int(servers_cnt[0])):
-                line = f.readline().split()
-                server = Server(line[0], validator.validate_rack(line[1]), validator.validate_ip(line[2]),
-                                validator.validate_int_value(line[3]),
-                                validator.validate_int_value(line[4]),
-                                validator.validate_int_value(line[5]))
-                server_config.append(server)
-            dao.create_servers(server_config)
-
-    # Creates instance based on the image and flavor configuration given by user
+            lines = enumerate(f, 1)
+            rejected, last_line = Controller.load_section(lines, file_name, Controller.parse_rack, dao.create_racks)
+            racks = set(dao.get_valid_racks())
+            server_rejected, last_line = Controller.load_section(
+                lines, file_name, lambda words: Controller.parse_server(words, racks), dao.create_servers, last_line)
+            rejected += server_rejected
+        Controller.check_rejected(file_name, rejected)
+
+    # Reads one section of a config file: a line with the number of entries, then one entry per line. Each line is
+    # parsed as it is read and the entries are written in chunks of CONFIG_CHUNK_SIZE. Lines that cannot be parsed,
+    # or repeat a name of the section, are reported and skipped. last_line is the number of the last line read before
+    # the section. Returns the number of lines skipped and the number of the last line read
+    @staticmethod
+    def load_section(lines, file_name, parse, write, last_line=0):
+        entry = next(lines, None)
+        if entry is None:
+            raise Exception(exp.CONFIG_COUNT_MISSING.format(file_name, last_line))
+        line_number, line = entry
+        try:
+            count = validator.validate_int_value(line.split()[0] if line.split() else None)
+        except (TypeError, ValueError) as e:
+            raise Exception(exp.CONFIG_LINE_INVALID.format(line_number, file_name, e))
+        names = set()
+        chunk = []
+        rejected = 0
+        for i in range(count):
+            entry = next(lines, None)
+            if entry is None:
+                print(exp.CONFIG_SECTION_SHORT.format(file_name, line_number, i, count))
+                rejected += count - i
+                break
+            line_number, line = entry
+            try:
+                document = parse(line.split())
+                if document.Name in names:
+                    raise Exception(exp.DUPLICATE_NAME.format(document.Name))
+            except Exception as e:
+                print(exp.CONFIG_LINE_INVALID.format(line_number, file_name, e))
+                rejected += 1
+                continue
+            names.add(document.Name)
+            chunk.append(document)
+            if len(chunk) == CONFIG_CHUNK_SIZE:
+                write(chunk)
+                chunk = []
+        if chunk:
+            write(chunk)
+        return rejected, line_number
+
+    # Raises when lines of the config file were skipped, after the other lines were loaded
+    @staticmethod
+    def check_rejected(file_name, rejected):
+        if rejected:
+            raise Exception(exp.CONFIG_LINES_REJECTED.format(rejected, file_name))
+
+    # Parses 'NAME SIZE PATH'
+    @staticmethod
+    def parse_image(words):
+        Controller.check_fields(words, 3)
+        return Image(words[0], validator.validate_int_value(words[1]), words[2])
+
+    # Parses 'NAME MEMORY DISK VCPU'
+    @staticmethod
+    def parse_flavor(words):
+        Controller.check_fields(words, 4)
+        return Flavor(words[0], validator.validate_int_value(words[1]), validator.validate_int_value(words[2]),
+                      validator.validate_int_value(words[3]))
+
+    # Parses 'NAME CAPACITY'
+    @staticmethod
+    def parse_rack(words):
+        Controller.check_fields(words, 2)
+        return Rack(words[0], validator.validate_int_value(words[1]))
+
+    # Parses 'NAME RACK IP MEMORY DISK VCPU'. The rack must be one of racks
+    @staticmethod
+    def parse_server(words, racks):
+        Controller.check_fields(words, 6)
+        if words[1] not in racks:
+            raise Exception(exp.RACK_NOT_FOUND.format(words[1]))
+        return Server(words[0], words[1], validator.validate_ip(words[2]), validator.validate_int_value(words[3]),
+                      validator.validate_int_value(words[4]), validator.validate_int_value(words[5]))
+
+    @staticmethod
+    def check_fields(words, count):
+        if len(words) != count:
+            raise Exception(exp.CONFIG_FIELDS_INVALID.format(count, len(words)))
+
+    # Creates instance based on the image and flavor configuration given by user. The best fit server is only a
+    # candidate: its capacity is taken with a conditional update, and if a concurrent command took it first the next
+    # best fit server is tried
     @staticmethod
     def create_instance_with_cache(name, flavor, image):
         rack_with_image_cached = dao.search_lookup(image)
-        if rack_with_image_cached:
-            server = Controller.best_fit(flavor, rack_with_image_cached)
-            if server is not None:
-                instance = Instance(name, flavor, image, server["Name"])
-                dao.create_instance(instance)
-            else:
-                racks = dao.get_valid_racks()
-                new_racks = [n for n in racks if n not in rack_with_image_cached]
-                server = Controller.best_fit(flavor, new_racks)
-                if server is not None:
-                    instance = Instance(name, flavor, image, server["Name"])
-                    dao.create_instance(instance)
-                else:
-                    raise Exception(exp.COMPATIBLE_MACHINE_UNAVAILABLE.format(name))
-        else:
-            server = Controller.best_fit(flavor)
-            if server is not None:
-                instance = Instance(name, flavor, image, server["Name"])
-                dao.create_instance(instance)
+        for attempt in range(PLACEMENT_RETRIES):
+            if rack_with_image_cached:
+                server = Controller.best_fit(flavor, rack_with_image_cached)
+                if server is None:
+                    server = Controller.best_fit(flavor, exclude_racks=rack_with_image_cached)
             else:
+                server = Controller.best_fit(flavor)
+            if server is None:
                 raise Exception(exp.COMPATIBLE_MACHINE_UNAVAILABLE.format(name))
+            if dao.create_instance(Instance(name, flavor, image, server["Name"])):
+                return
+        raise Exception(exp.PLACEMENT_CONFLICT.format(name))
+
+    # Creates the instance on a server of racks, preferring those that already cache the image, with the same
+    # conditional reservation as create_instance_with_cache. Returns the server name, or None, creating nothing, when
+    # no server of racks can host the instance. Used by the Scheduler workers, which each own their racks
+    @staticmethod
+    def create_instance_in_racks(name, flavor, image, racks):
+        cached = [rack for rack in dao.search_lookup(image) or () if rack in racks]
+        for attempt in range(PLACEMENT_RETRIES):
+            server = Controller.best_fit(flavor, cached) if cached else None
+            if server is None:
+                server = Controller.best_fit(flavor, racks, cached)
+            if server is None:
+                return None
+            if dao.create_instance(Instance(name, flavor, image, server["Name"])):
+                return server["Name"]
+        raise Exception(exp.PLACEMENT_CONFLICT.format(name))
+
+    # Reads (instance name, image, flavor) requests, one per line, from the file or from standard input for '-'
+    @staticmethod
+    def read_instance_requests(file_name):
+        f = sys.stdin if file_name == '-' else open(file_name, "r")
+        try:
+            requests = []
+            for line_number, line in enumerate(f, 1):
+                line = line.split('#')[0].split()
+                if not line:
+                    continue
+                if len(line) != 3:
+                    raise Exception(exp.BATCH_LINE_INVALID.format(line_number))
+                requests.append((line[0], line[1], line[2]))
+            return requests
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    # Creates many instances at once. All placements are computed in memory in one pass, then instances, server
+    # capacity and rack caches are written in bulk. Requests that cannot be placed are reported and skipped
+    @staticmethod
+    def create_instances_batch(requests):
+        planner = Planner()
+        for name, image, flavor in requests:
+            planner.place(name, flavor, image)
+        dao.apply_plan(planner.plan)
+        for failure in planner.plan.failures:
+            print(failure)
+
+    # Selects the eviction policy of the rack image cache
+    @staticmethod
+    def set_cache_policy(rack, policy):
+        dao.set_rack_cache_policy(rack, policy)
 
     # Adds a new machine. Used after the sick machine is fixed
     @staticmethod
@@ -99,21 +229,26 @@ class Controller:
     # Checks if the machine can support flavor. Returns Yes if can otherwise No
     @staticmethod
     def can_host_flavor(f, s):
-        flavor = dao.get_flavor(f)
-        server = dao.get_server(s)
+        flavor = dao.get_flavor(f, dao.FLAVOR_RESOURCE_FIELDS)
+        server = dao.get_server(s, dao.SERVER_CAPACITY_FIELDS)
         print("yes" if Controller.can_host(flavor, server) else "No")
 
-    # Runs best fit algorithm to check which machine can host instance
+    # Runs best fit algorithm to check which machine can host instance. Racks in exclude_racks are not considered
     @staticmethod
-    def best_fit(f, racks=None):
-        flavor = dao.get_flavor(f)
-        servers = dao.get_all_servers(racks)
-        server = None
-        for s in servers:
-            if Controller.can_host(flavor, s):
-                server = s
-                break
-        return server
+    def best_fit(f, racks=None, exclude_racks=None):
+        flavor = dao.get_flavor(f, dao.FLAVOR_RESOURCE_FIELDS)
+        return dao.find_best_fit(flavor, racks, exclude_racks, ["Name", "Rack"])
+
+    # Returns, for every flavor, how many more instances of it the active servers can host and on how many servers
+    @staticmethod
+    def capacity_report():
+        flavors = list(dao.get_all_flavors(dao.FLAVOR_RESOURCE_FIELDS))
+        model = CapacityModel(dao.get_all_servers(None, dao.SERVER_CAPACITY_FIELDS))
+        report = []
+        for flavor, (count, servers) in zip(flavors, model.headroom(flavors)):
+            report.append({"Flavor": flavor["Name"], "Memory": flavor["Memory"], "Disk": flavor["Disk"],
+                           "VCPU": flavor["VCPU"], "Servers": servers, "Fits": count})
+        return report
 
     @staticmethod
     def can_host(flavor, server):
@@ -128,56 +263,48 @@ class Controller:
     # an exception.
     @staticmethod
     def remove_server(server):
-        instances = dao.get_all_instances([server])
-        dao.deactivate_server(server)
-        instances_migrated = []
-        for instance in instances:
-            flavor = instance["Flavor"]
-            new_server = Controller.best_fit(flavor)
-            if new_server is not None:
-                instances_migrated.append(instance)
-                dao.delete_instance(instance["Name"])
-                new_instance = Instance(instance["Name"], instance["Flavor"], instance["Image"], new_server["Name"])
-                dao.create_instance(new_instance)
-            else:
-                dao.reactivate_server(server)
-                for ins in instances_migrated:
-                    dao.delete_instance(ins["Name"])
-                for ins in instances_migrated:
-                    roll_back_instance = Instance(ins["Name"], ins["Flavor"], ins["Image"], ins["Server"])
-                    dao.create_instance(roll_back_instance)
-                raise Exception(exp.MIGRATION_NOT_POSSIBLE.format(instance["Name"]))
-        dao.delete_server(server)
+        dao.apply_plan(Controller.plan_server_removal(server))
+
+    # Plans the removal of the server: its instances are packed onto the other active servers and the server is
+    # deleted. Raises if any instance cannot be moved. Nothing is written
+    @staticmethod
+    def plan_server_removal(server):
+        planner = Planner()
+        planner.delete(server)
+        if not planner.move_all(dao.get_all_instances([server])):
+            raise Exception(planner.plan.failures[0])
+        return planner.plan
 
     # Migrates all the instances of the rack into another racks. Renders all the machine in the rack unusable after
-    # evacuation is completed. If any of the instance cannot be migrated, the entire operation is aborted
+    # evacuation is completed. The whole migration is planned in memory first. If any of the instance cannot be
+    # migrated, the entire operation is aborted before anything is written, otherwise all the moves are written at once
     @staticmethod
     def migrate_rack(rack):
-        servers = dao.get_all_servers([rack])
+        dao.apply_plan(Controller.plan_rack_evacuation(rack))
+
+    # Plans the evacuation of the rack: its servers are deactivated and their instances packed onto the servers of
+    # the other racks. Raises if any instance cannot be moved. Nothing is written
+    @staticmethod
+    def plan_rack_evacuation(rack):
         racks = dao.get_valid_racks()
         racks.remove(rack)
-        instances_migrated = []
-        servers_to_deactivate = []
+        planner = Planner()
+        servers = [server["Name"] for server in dao.get_all_servers([rack], ["Name"])]
         for server in servers:
-            servers_to_deactivate.append(server)
-            instances = dao.get_all_instances([server["Name"]])
-            for instance in instances:
-                flavor = instance["Flavor"]
-                new_server = Controller.best_fit(flavor, racks)
-                if new_server is not None:
-                    instances_migrated.append(instance)
-                    dao.delete_instance(instance["Name"])
-                    new_instance = Instance(instance["Name"], instance["Flavor"], instance["Image"], new_server["Name"])
-                    dao.create_instance(new_instance)
-                else:
-                    for ins in instances_migrated:
-                        dao.delete_instance(ins["Name"])
-                    for ins in instances_migrated:
-                        roll_back_instance = Instance(ins["Name"], ins["Flavor"], ins["Image"], ins["Server"])
-                        dao.create_instance(roll_back_instance)
-                    raise Exception(exp.MIGRATION_NOT_POSSIBLE.format(instance["Name"]))
-        for server in servers_to_deactivate:
-            dao.deactivate_server(server["Name"])
+            planner.deactivate(server)
+        if not planner.move_all(dao.get_all_instances(servers), racks):
+            raise Exception(planner.plan.failures[0])
+        return planner.plan
+
+    # Replays the workload trace against an in-memory copy of the data center and returns the Simulator report
+    @staticmethod
+    def simulate(trace):
+        return Simulator().run(trace)
+
+    # Stores a plan returned by plan_server_removal or plan_rack_evacuation
+    @staticmethod
+    def apply_plan(plan):
+        dao.apply_plan(plan)
 
     # Removes instance from database
     @staticmethod
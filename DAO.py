@@ -1,351 +1,312 @@
-from pymongo import MongoClient
-import datetime
+import os
 MongoDB_Server_IP = 'localhost'
 MongoDB_Server_Port = 27017
 MongoDB_Server_Database = 'Aggiestack_2_0_128002165'
 
+# Connection pool settings shared by every DAO call. Timeouts are in milliseconds
+MongoDB_Max_Pool_Size = 10
+MongoDB_Min_Pool_Size = 0
+MongoDB_Connect_Timeout = 5000
+MongoDB_Socket_Timeout = 30000
+MongoDB_Server_Selection_Timeout = 5000
 
-# Creates a connection object to Connect to Mongo DB
-def connection():
-    conn = MongoClient(MongoDB_Server_IP, MongoDB_Server_Port)
-    db = conn[MongoDB_Server_Database]
-    return db
+# Storage backend used by the process. 'mongo' keeps the data in MongoDB, 'memory' keeps it in process and, when a
+# snapshot file is given, persists it there between commands
+Storage_Backend = os.environ.get('AGGIESTACK_BACKEND', 'mongo')
+Memory_Snapshot_File = os.environ.get('AGGIESTACK_SNAPSHOT')
 
+# Version of the database layout created by initialize(). Raise it whenever initialize() changes
+Schema_Version = 1
 
-# Initializes the database and creates necessary collection each with 'Name' as primary key
+# Fields read by callers that only need the resources of a flavor or the free capacity of a server. Reads take a
+# fields list like these to fetch only part of each document
+FLAVOR_RESOURCE_FIELDS = ["Name", "Memory", "Disk", "VCPU"]
+SERVER_CAPACITY_FIELDS = ["Name", "Rack", "Memory_free", "disk_free", "VCPU_free", "isActive"]
+
+# Process wide backend. Created on first use and reused by every call
+_backend = None
+
+# Functions called with a collection name after every write to that collection. Used to drop cached reads
+_write_listeners = []
+
+
+# Returns the active backend, creating the configured one on first use
+def backend():
+    global _backend
+    if _backend is None:
+        if Storage_Backend == 'memory':
+            from storage.MemoryBackend import MemoryBackend
+            _backend = MemoryBackend(Memory_Snapshot_File)
+        else:
+            from storage.MongoBackend import MongoBackend
+            _backend = MongoBackend(MongoDB_Server_IP, MongoDB_Server_Port, MongoDB_Server_Database,
+                                    max_pool_size=MongoDB_Max_Pool_Size,
+                                    min_pool_size=MongoDB_Min_Pool_Size,
+                                    connect_timeout=MongoDB_Connect_Timeout,
+                                    socket_timeout=MongoDB_Socket_Timeout,
+                                    server_selection_timeout=MongoDB_Server_Selection_Timeout)
+    return _backend
+
+
+# Replaces the active backend. Used by simulations and scripts that bring their own store
+def use_backend(new_backend):
+    global _backend
+    close()
+    _backend = new_backend
+    _written("Flavors", "Images", "Racks", "Servers", "Instances")
+
+
+# Makes the writes done so far durable without closing the backend
+def flush():
+    if _backend is not None:
+        _backend.flush()
+
+
+# Closes the active backend. The next call creates a new one
+def close():
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+
+# Returns the number of requests sent to the store by this process. 0 before the backend is first used
+def round_trips():
+    return _backend.round_trips() if _backend is not None else 0
+
+
+# Registers a function to be called with the collection name after every write to that collection
+def add_write_listener(listener):
+    _write_listeners.append(listener)
+
+
+# Notifies the write listeners that the collections changed
+def _written(*collections):
+    for listener in _write_listeners:
+        for collection in collections:
+            listener(collection)
+
+
+# Initializes the database and creates necessary collection each with 'Name' as primary key. Records the layout
+# version so later runs can skip it
 def initialize():
-    db = connection()
-    db["Racks"].create_index("Name", unique=True)
-    db["Servers"].create_index("Name", unique=True)
-    db["Flavors"].create_index("Name", unique=True)
-    db["Images"].create_index("Name", unique=True)
-    db["Instances"].create_index("Name", unique=True)
-    db["ImageLookup"].create_index("Image", unique=True)
+    backend().initialize()
+    backend().set_schema_version(Schema_Version)
+
+
+# Returns the layout version the database was last initialized with, 0 if never
+def schema_version():
+    return backend().get_schema_version()
 
 
 # This is a used for Part-C. Searches the Racks for cached copy of the request image. Returns None if cannot
 # find any
 def search_lookup(image):
-    db = connection()
-    lookup = db["ImageLookup"]
-    result = lookup.find_one({'Image': image})
-    if result is not None:
-        return result["Racks"]
-    else:
-        return result
+    return backend().search_lookup(image)
 
 
 # Updates the Rack-Image-Cache table every time new image is added or old image is removed from the Racks
 def update_lookup(image, rack, flag=False):
-    db = connection()
-    lookup = db["ImageLookup"]
-    if lookup.find({'Image': image}).count() > 0:
-        if flag:
-            lookup.update({"Image": image}, {"$pull": {"Racks": rack}})
-        else:
-            lookup.update({"Image": image}, {"$addToSet": {"Racks": rack}})
-    else:
-        if not flag:
-            cache = dict()
-            cache["Image"] = image
-            cache["Racks"] = [rack]
-            lookup.insert_one(cache)
+    backend().update_lookup(image, rack, flag)
 
 
-# Creates Flavors from flavor configuration file. Using bulk execute operation to improve efficiency of write operation
+# Creates Flavors from flavor configuration file
 def create_flavors(list_flavors):
-    db = connection()
-    flavors = db["Flavors"]
-    bulk = flavors.initialize_ordered_bulk_op()
-    for flavor in list_flavors:
-        bulk.find({'Name': flavor.Name}).upsert().update({"$set": flavor.__dict__})
-    bulk.execute()
+    backend().create_flavors(list_flavors)
+    _written("Flavors")
 
 
 # Returns the flavor present in database else returns None
-def get_flavor(name):
-    db = connection()
-    flavors = db["Flavors"]
-    result = flavors.find_one({'Name': name})
-    return result
+def get_flavor(name, fields=None):
+    return backend().get_flavor(name, fields)
 
 
-# Returns all the flavors in the database
-def get_all_flavors():
-    db = connection()
-    flavors = db["Flavors"]
-    result = flavors.find()
-    return result
+# Returns all the flavors in the database. fields limits the fields read, offset and limit select one page
+def get_all_flavors(fields=None, offset=0, limit=None):
+    return backend().get_all_flavors(fields, offset, limit)
 
 
 # Return valid flavors
 def get_valid_flavors():
-    result = []
-    flavors = get_all_flavors()
-    if flavors is not None:
-        for flavor in flavors:
-            result.append(flavor["Name"])
-    return result
+    return backend().get_valid_flavors()
 
 
-# Creates images that are read from image configuration file. Uses bulk operation for efficient database write
+# Creates images that are read from image configuration file
 def create_images(list_images):
-    db = connection()
-    flavors = db["Images"]
-    bulk = flavors.initialize_ordered_bulk_op()
-    for image in list_images:
-        bulk.find({'Name': image.Name}).upsert().update({"$set": image.__dict__})
-    bulk.execute()
+    backend().create_images(list_images)
+    _written("Images")
 
 
 # Returns the images present in database else returns None
-def get_image(name):
-    db = connection()
-    images = db["Images"]
-    result = images.find_one({'Name': name})
-    return result
+def get_image(name, fields=None):
+    return backend().get_image(name, fields)
 
 
-# Returns all the images in database
-def get_all_images():
-    db = connection()
-    images = db["Images"]
-    result = images.find()
-    return result
+# Returns all the images in database. fields limits the fields read, offset and limit select one page
+def get_all_images(fields=None, offset=0, limit=None):
+    return backend().get_all_images(fields, offset, limit)
 
 
 # Returns valid images
 def get_valid_images():
-    result = []
-    images = get_all_images()
-    if images is not None:
-        for image in images:
-            result.append(image["Name"])
-    return result
+    return backend().get_valid_images()
 
 
 # Creates Racks from configuration file.
 def create_racks(list_racks):
-    db = connection()
-    racks = db["Racks"]
-    bulk = racks.initialize_ordered_bulk_op()
-    for rack in list_racks:
-        bulk.find({'Name': rack.Name}).upsert().update({"$set": rack.__dict__})
-    bulk.execute()
+    backend().create_racks(list_racks)
+    _written("Racks")
 
 
 # Returns the rack requested
-def get_rack(r):
-    db = connection()
-    racks = db["Racks"]
-    rack = racks.find_one({"Name": r})
-    return rack
+def get_rack(r, fields=None):
+    return backend().get_rack(r, fields)
+
+
+# Returns all the racks in database
+def get_all_racks(fields=None):
+    return backend().get_all_racks(fields)
 
 
 # Returns the list of rack currently present in the database
 def get_valid_racks():
-    db = connection()
-    racks = db["Racks"]
-    result = racks.find()
-    valid_racks = []
-    for rack in result:
-        valid_racks.append(rack["Name"])
-    return valid_racks
-
-
-# Removes the cached image from the rack
-def remove_image_from_rack_cache(r):
-    db = connection()
-    racks = db["Racks"]
-    rack = racks.find_one({"Name": r})
-    if rack is not None:
-        lru = racks.aggregate([{"$match": {"Name": r}},
-                               {"$unwind": "$ImageCache"},
-                               {"$sort": {"ImageCache.Timestamp": 1}},
-                               {"$limit": 1}])
-        list_lru = list(lru)
-        if list_lru:
-            lru_image = list_lru[0]["ImageCache"]
-            racks.update({"Name": r}, {"$pull": {"ImageCache": {"Name": lru_image["Name"]}},
-                                       "$inc": {"AvailableCapacity": lru_image["Size"]}})
-            update_lookup(lru_image["Name"], r, True)
-
-
-# Creates or updates the image cache. Updates the timestamp of the image to most recently time.
-def update_or_create_image_in_rack_cache(r, img):
-    db = connection()
-    racks = db["Racks"]
-    image = get_image(img)
-    if racks.find({"Name": r, "ImageCache.Name": img}).count() > 0:
-        racks.update({"Name": r}, {"$pull": {"ImageCache": {"Name": img}}})
-        image["Timestamp"] = datetime.datetime.utcnow()
-        racks.update({"Name": r}, {"$addToSet": {"ImageCache": image}})
-    else:
-        image["Timestamp"] = datetime.datetime.utcnow()
-        racks.update({"Name": r}, {"$addToSet": {"ImageCache": image}, "$inc": {"AvailableCapacity": -image["Size"]}})
-        update_lookup(img, r)
+    return backend().get_valid_racks()
+
+
+# Selects the eviction policy of the rack image cache
+def set_rack_cache_policy(r, policy):
+    backend().set_rack_cache_policy(r, policy)
 
 
 # Creates individual Machine if non existing, Updates if deactivated. Used during add machine operation.
 def create_server(server):
-    db = connection()
-    servers = db["Servers"]
-    if servers.find({"Name": server.Name, "isActive": True}).count() > 0:
-        print("Machine \"{}\" already exists".format(server.Name))
-        return
-    servers.update_one({'Name': server.Name}, {"$set": server.__dict__}, upsert=True)
+    backend().create_server(server)
+    _written("Servers")
 
 
-# Creates multiple machine at once. Used during config hardware operation
+# Creates multiple machine at once. Used during config hardware operation. Machines already present are left as they
+# are
 def create_servers(list_servers):
-    db = connection()
-    servers = db["Servers"]
-    list_of_servers = []
-    for server in list_servers:
-        list_of_servers.append(server.__dict__)
-    servers.insert_many(list_of_servers)
+    backend().create_servers(list_servers)
+    _written("Servers")
 
 
 # Deletes the machine from database
 def delete_server(server_name):
-    db = connection()
-    servers = db["Servers"]
-    server = servers.find_one({"Name": server_name})
-    if server is not None:
-        servers.remove(server)
+    backend().delete_server(server_name)
+    _written("Servers")
 
 
 # Deactivates the active state of machine
 def deactivate_server(server_name):
-    db = connection()
-    servers = db["Servers"]
-    servers.update({"Name": server_name}, {"$set": {"isActive": False}})
+    backend().deactivate_server(server_name)
 
 
 # Reactivates the server state of machine
 def reactivate_server(server_name):
-    db = connection()
-    servers = db["Servers"]
-    servers.update({"Name": server_name}, {"$set": {"isActive": True}})
+    backend().reactivate_server(server_name)
 
 
 # Returns all the servers created in increasing order of available memory, disk and vcpu
-def get_all_servers(racks=None):
-    db = connection()
-    servers = db["Servers"]
-    if racks is not None:
-        result = servers.find({"Rack": {"$in": racks}, "isActive": True})\
-            .sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
-    else:
-        result = servers.find({"isActive": True}).sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
+def get_all_servers(racks=None, fields=None):
+    return backend().get_all_servers(racks, fields)
 
-    return result
 
-
-# Returns all the servers present in database irrespective of their active status
-def get_all_valid_server():
-    db = connection()
-    servers = db["Servers"]
-    result = servers.find().sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
-    return result
+# Returns all the servers present in database irrespective of their active status. fields limits the fields read,
+# offset and limit select one page
+def get_all_valid_server(fields=None, offset=0, limit=None):
+    return backend().get_all_valid_server(fields, offset, limit)
 
 
 # Returns all servers not present in racks
 def get_all_servers_except(racks):
-    db = connection()
-    servers = db["Servers"]
-    all_servers = servers.find({"Rack": {"$nin": racks}, "isActive": True})
-    return all_servers
+    return backend().get_all_servers_except(racks)
 
 
 # Return the server by name
-def get_server(name):
-    db = connection()
-    servers = db["Servers"]
-    result = servers.find_one({"Name": name})
-    return result
+def get_server(name, fields=None):
+    return backend().get_server(name, fields)
+
+
+# Returns the best fit active server for the flavor document, optionally limited to racks or skipping exclude_racks
+def find_best_fit(flavor, racks=None, exclude_racks=None, fields=None):
+    return backend().find_best_fit(flavor, racks, exclude_racks, fields)
+
+
+# Returns True if the flavor exists
+def flavor_exists(name):
+    return backend().name_exists("Flavors", name)
+
+
+# Returns True if the image exists
+def image_exists(name):
+    return backend().name_exists("Images", name)
+
+
+# Returns True if the rack exists
+def rack_exists(name):
+    return backend().name_exists("Racks", name)
+
+
+# Returns True if the server exists, active or not
+def server_exists(name):
+    return backend().name_exists("Servers", name)
+
+
+# Returns True if the instance exists
+def instance_exists(name):
+    return backend().name_exists("Instances", name)
+
+
+# Returns the subset of names that belong to existing instances
+def get_existing_instance_names(names):
+    return backend().get_existing_instance_names(names)
 
 
 # Return the servers currently present in the database
 def get_valid_server():
-    result = get_all_valid_server()
-    servers = []
-    if result is not None:
-        for server in result:
-            servers.append(server["Name"])
-    return servers
+    return backend().get_valid_server()
 
 
 # Updates the server when new instance is created or deleted
 def update_server(server_name, flavor, flag):
-    db = connection()
-    servers = db["Servers"]
-    flavor_details = get_flavor(flavor)
-    if flag:
-        servers.update({"Name": server_name}, {
-                                           "$inc": {"Memory_free": -flavor_details["Memory"],
-                                                    "VCPU_free": -flavor_details["VCPU"],
-                                                    "disk_free": -flavor_details["Disk"]}})
-    else:
-        servers.update({"Name": server_name}, {
-                                           "$inc": {"Memory_free": flavor_details["Memory"],
-                                                    "VCPU_free": flavor_details["VCPU"],
-                                                    "disk_free": flavor_details["Disk"]}})
-
-
-# Creates instance if instance with same name doesnot exists
+    backend().update_server(server_name, flavor, flag)
+
+
+# Creates instance if instance with same name doesnot exists, taking its resources from its server. Returns False,
+# changing nothing, if the server no longer has them
 def create_instance(new_instance):
-    db = connection()
-    instances = db["Instances"]
-    if instances.find({'Name': new_instance.Name}).count() > 0:
-        print("Instance \"{}\" already exists".format(new_instance.Name))
-        return
-    server = get_server(new_instance.Server)
-    check_lru(server["Rack"], new_instance.Image)
-    instances.insert_one(new_instance.__dict__)
-    update_server(new_instance.Server, new_instance.Flavor, True)
+    created = backend().create_instance(new_instance)
+    _written("Instances")
+    return created
 
 
 # Performs Least Recently used algorithm in the image cache
 def check_lru(r, img):
-    rack = get_rack(r)
-    image = get_image(img)
-    if rack["Capacity"] >= image["Size"]:
-        cached_images = []
-        for images in rack["ImageCache"]:
-            cached_images.append(images["Name"])
-        if img not in cached_images:
-            while rack["AvailableCapacity"] < image["Size"]:
-                remove_image_from_rack_cache(r)
-                rack = get_rack(r)
-        update_or_create_image_in_rack_cache(r, img)
+    backend().check_lru(r, img)
 
 
 # Delete instance from database
 def delete_instance(name):
-    db = connection()
-    instances = db["Instances"]
-    instance = instances.find_one({"Name": name})
-    if instance is not None:
-        instances.remove(instance)
-        update_server(instance["Server"], instance["Flavor"], False)
+    backend().delete_instance(name)
+    _written("Instances")
 
 
-# Returns the list of all instance present in server. By default returns all instances in datacenter
-def get_all_instances(server=None):
-    db = connection()
-    instances = db["Instances"]
-    if server is not None:
-        result = instances.find({"Server": {"$in": server}})
-    else:
-        result = instances.find()
-    return result
+# Returns the list of all instance present in server. By default returns all instances in datacenter. fields limits
+# the fields read, offset and limit select one page
+def get_all_instances(server=None, fields=None, offset=0, limit=None):
+    return backend().get_all_instances(server, fields, offset, limit)
 
 
 # Returns list of instance present in database. Used for validation
 def get_all_instances_name():
-    instances = get_all_instances()
-    instance_name = []
-    for instance in instances:
-        instance_name.append(instance["Name"])
-    return instance_name
+    return backend().get_all_instances_name()
+
+
+# Stores every write computed by a Planner in bulk. A plan without writes, e.g. a batch where no request could be
+# placed, starts no transaction
+def apply_plan(plan):
+    if plan.is_empty():
+        return
+    backend().apply_plan(plan)
+    _written("Instances", "Servers")
@@ -0,0 +1,188 @@
+"""Long running aggiestack process. 'aggiestack serve' keeps the database connection, caches and placement indexes
+warm and runs commands sent over a Unix domain socket. Any other invocation first tries to forward its arguments to
+the daemon and only runs the command itself when no daemon is listening.
+
+The socket lives in a directory of the user: $XDG_RUNTIME_DIR, else ~/.aggiestack created with mode 0700. Commands
+are only forwarded to a socket owned by the same user.
+
+Every message is one line of JSON. The client sends one request; the daemon streams the output of the command as
+it is printed, one frame per batch of lines, and ends with a status frame:
+    {"argv": ["show", "hardware"], "cwd": "/home/user", "stdin": null}
+    {"output": "..."}
+    {"ok": true, "done": true}
+"""
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import Exceptions as exp
+
+
+def _socket_directory():
+    return os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.aggiestack')
+
+
+SOCKET_PATH = os.environ.get('AGGIESTACK_SOCKET') or os.path.join(_socket_directory(), 'aggiestack.sock')
+
+# Seconds the daemon waits on a client to send its request or take its output before dropping it
+CLIENT_TIMEOUT = 30
+
+
+def _send(conn, message):
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+# Turns SIGTERM into a normal exit so the socket file is removed
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def _receive(conn):
+    with conn.makefile("r", encoding="utf-8") as f:
+        line = f.readline()
+    return json.loads(line) if line else None
+
+
+# Returns True if a daemon answers on the socket
+def _listening(socket_path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        conn.close()
+
+
+# Accepts commands until interrupted or terminated. execute is called with the command words and returns True on
+# success. Commands run one at a time in the working directory of the client, with their output streamed back. A client
+# that sends nothing or stops reading for CLIENT_TIMEOUT seconds is dropped.
+# Refuses to start when another daemon already answers on the socket; a socket file left by a daemon that died is
+# replaced
+def serve(execute, socket_path=SOCKET_PATH):
+    if os.path.exists(socket_path):
+        if _listening(socket_path):
+            print(exp.DAEMON_ALREADY_RUNNING.format(socket_path))
+            return
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), mode=0o700, exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    signal.signal(signal.SIGTERM, _stop)
+    print("aggiestack daemon listening on {}".format(socket_path))
+    try:
+        while True:
+            conn, _ = server.accept()
+            conn.settimeout(CLIENT_TIMEOUT)
+            with conn:
+                try:
+                    request = _receive(conn)
+                except (OSError, ValueError):
+                    continue
+                if request is None:
+                    continue
+                ok = _run(execute, request, _Stream(conn))
+                try:
+                    _send(conn, {"ok": ok, "done": True})
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# Standard output and error of a command run by the daemon. Every complete line written is sent to the client
+# right away; a partial line waits for the end of its line or for flush. A client that went away or stopped reading
+# gets no more output, while the command runs to the end
+class _Stream(io.TextIOBase):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = ""
+        self.closed_by_client = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.pending += text
+        end = self.pending.rfind("\n") + 1
+        if end:
+            self._send(self.pending[:end])
+            self.pending = self.pending[end:]
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            self._send(self.pending)
+            self.pending = ""
+
+    def _send(self, text):
+        if self.closed_by_client:
+            return
+        try:
+            _send(self.conn, {"output": text})
+        except OSError:
+            self.closed_by_client = True
+
+
+# Runs the command with its output written to the stream. Returns True on success
+def _run(execute, request, stream):
+    cwd = os.getcwd()
+    stdin = sys.stdin
+    ok = False
+    try:
+        os.chdir(request.get("cwd") or cwd)
+        if request.get("stdin") is not None:
+            sys.stdin = io.StringIO(request["stdin"])
+        with contextlib.redirect_stdout(stream), contextlib.redirect_stderr(stream):
+            ok = execute(request["argv"])
+    except Exception as e:
+        stream.write("{}\n".format(e))
+    finally:
+        sys.stdin = stdin
+        os.chdir(cwd)
+        stream.flush()
+    return ok
+
+
+# Sends the command to the daemon and prints its output as it arrives. Returns False when no daemon is listening, in
+# which case the caller runs the command itself. A socket owned by another user is never used, since whoever created it
+# would receive the command, its working directory and its input. Standard input is sent along when the command reads
+# it through '-'
+def forward(argv, socket_path=SOCKET_PATH):
+    try:
+        if os.stat(socket_path).st_uid != os.getuid():
+            return False
+    except OSError:
+        return False
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError:
+        conn.close()
+        return False
+    with conn:
+        stdin = sys.stdin.read() if '-' in argv else None
+        _send(conn, {"argv": list(argv), "cwd": os.getcwd(), "stdin": stdin})
+        conn.shutdown(socket.SHUT_WR)
+        with conn.makefile("r", encoding="utf-8") as f:
+            for line in f:
+                message = json.loads(line)
+                if message.get("done"):
+                    break
+                sys.stdout.write(message["output"])
+                sys.stdout.flush()
+    return True
@@ -1,98 +1,187 @@
+import csv
+import io
+import itertools
+import json
+import sys
 import DAO as dao
+from RackCache import RackCache
+
+
+# Columns of each listing, in the order of the model attributes
+FLAVOR_HEADERS = ["Name", "Memory", "Disk", "VCPU"]
+IMAGE_HEADERS = ["Name", "Size", "Path"]
+SERVER_HEADERS = ["Name", "IP", "Memory", "Disk", "VCPU", "Memory_free", "VCPU_free", "disk_free", "Rack", "isActive"]
+SERVER_CAPACITY_HEADERS = ["Memory_free", "VCPU_free", "disk_free", "isActive"]
+INSTANCE_HEADERS = ["Name", "Image", "Flavor", "Server"]
+STATS_HEADERS = ["Call", "Calls", "Total_ms", "Mean_ms", "Max_ms", "Documents", "RoundTrips"]
+
+# Rows read before the column widths are fixed. Later rows wider than all of them are printed unpadded
+WIDTH_SAMPLE_ROWS = 200
+
+# Lines collected before each write to standard output
+WRITE_BATCH_LINES = 500
+
+# Output formats of the show commands: aligned text, one JSON object per line, or CSV with a header line
+FORMATS = ("table", "jsonl", "csv")
 
 
 class Display:
-    # Display the flavor created in tabular format
+    # Display the flavor created in tabular format, or in output_format. offset and limit select one page
     @staticmethod
-    def display_flavors():
-        flavors = []
-        for flavor in dao.get_all_flavors():
-            flavors.append(flavor)
-        if flavors:
-            headers = list(flavors[0].keys())
-            headers.remove('_id')
-            Display.print_table(flavors, headers)
-        else:
-            print("No Flavors available")
+    def display_flavors(offset=0, limit=None, output_format="table"):
+        Display.write_rows(dao.get_all_flavors(FLAVOR_HEADERS, offset, limit), FLAVOR_HEADERS, output_format,
+                           "No Flavors available")
 
-    # Display the images created in tabular format
+    # Display the images created in tabular format, or in output_format. offset and limit select one page
     @staticmethod
-    def display_images():
-        images = []
-        for image in dao.get_all_images():
-            images.append(image)
-        if images:
-            headers = list(images[0].keys())
-            headers.remove('_id')
-            Display.print_table(images, headers)
-        else:
-            print("No Images available")
+    def display_images(offset=0, limit=None, output_format="table"):
+        Display.write_rows(dao.get_all_images(IMAGE_HEADERS, offset, limit), IMAGE_HEADERS, output_format,
+                           "No Images available")
 
-    # Display the Servers created in tabular format. Flag = true displays verbose information.
+    # Display the Servers created in tabular format, or in output_format. Flag = true displays verbose information.
+    # offset and limit select one page
     @staticmethod
-    def display_servers(flag=False):
-        servers = []
-        for server in dao.get_all_valid_server():
-            servers.append(server)
-        if servers:
-            headers = list(servers[0].keys())
-            headers.remove('_id')
-
-            if not flag:
-                headers.remove('isActive')
-                headers.remove('Memory_free')
-                headers.remove('VCPU_free')
-                headers.remove('disk_free')
-            Display.print_table(servers, headers)
-        else:
-            print("No Machines available")
+    def display_servers(flag=False, offset=0, limit=None, output_format="table"):
+        headers = SERVER_HEADERS
+        if not flag:
+            headers = [header for header in headers if header not in SERVER_CAPACITY_HEADERS]
+        Display.write_rows(dao.get_all_valid_server(headers, offset, limit), headers, output_format,
+                           "No Machines available")
 
-    # Display the Instances created in tabular format. Flag = true displays verbose information.
+    # Display the Instances created in tabular format, or in output_format. Flag = true displays verbose information.
+    # offset and limit select one page
     @staticmethod
-    def display_instances(flag=False):
-        instances = []
-        for instance in dao.get_all_instances():
-            instances.append(instance)
-        if instances:
-            headers = list(instances[0].keys())
-            headers.remove('_id')
-            if not flag:
-                headers.remove("Server")
-            Display.print_table(instances, headers)
-        else:
-            print("No Instances available")
+    def display_instances(flag=False, offset=0, limit=None, output_format="table"):
+        headers = INSTANCE_HEADERS if flag else INSTANCE_HEADERS[:-1]
+        Display.write_rows(dao.get_all_instances(None, headers, offset, limit), headers, output_format,
+                           "No Instances available")
 
-    # Display the Images cached in the racks.
+    # Display the Images cached in the racks, the eviction policy and the hit, miss and eviction counters.
     @staticmethod
-    def display_image_cache(r):
-        rack = dao.get_rack(r)
+    def display_image_cache(r, output_format="table"):
+        rack = dao.get_rack(r, ["Name", "AvailableCapacity", "ImageCache.Name", "CachePolicy", "CacheStats"])
         if rack is not None:
-            headers = list(rack.keys())
             images = []
             for image in rack["ImageCache"]:
                 images.append(image["Name"])
             rack["ImageCache"] = images
-            headers.remove('_id')
-            headers.remove('Capacity')
+            rack["CachePolicy"] = RackCache.policy(rack).name
+            rack.update(RackCache.stats(rack))
+            headers = ["Name", "AvailableCapacity", "ImageCache", "CachePolicy", "Hits", "Misses", "Evictions",
+                       "EvictedBytes"]
             racks = [rack]
-            Display.print_table(racks, headers)
+            Display.write_rows(racks, headers, output_format)
         else:
             print("No Racks available")
 
+    # Display the instance moves of a migration plan before it is applied
     @staticmethod
-    def print_table(dictionary, headers=None):
+    def display_plan(plan):
+        if plan.moves:
+            moves = [{"Instance": name, "From": plan.sources[name], "To": server}
+                     for name, server in sorted(plan.moves.items())]
+            Display.print_table(moves, ["Instance", "From", "To"])
+        else:
+            print("No Instances to migrate")
+
+    # Display how many more instances of every flavor the active machines can host
+    @staticmethod
+    def display_capacity(report, output_format="table"):
+        Display.write_rows(report, ["Flavor", "Memory", "Disk", "VCPU", "Servers", "Fits"], output_format,
+                           "No Flavors available")
+
+    # Display the report of a simulated trace (Simulator.report)
+    @staticmethod
+    def display_simulation(report):
+        Display.print_table([report["Summary"]])
+        Display.print_table(report["Resources"], ["Resource", "Total", "Used", "Utilization", "Fragmentation"])
+        Display.print_table(report["Headroom"], ["Flavor", "Fits"])
+        for failure in report["Failures"]:
+            print(failure)
+
+    # Display the report of a parallel batch (Scheduler.report)
+    @staticmethod
+    def display_schedule(report):
+        Display.print_table([report["Summary"]])
+        Display.print_table(report["Workers"], ["Worker", "Racks", "Servers", "Assigned", "Done", "Failed", "Stolen",
+                                                "Outside"])
+        for failure in report["Failures"]:
+            print(failure)
+
+    # Display the calls counted by Instrumentation
+    @staticmethod
+    def display_stats(rows, output_format="table"):
+        Display.write_rows(rows, STATS_HEADERS, output_format, "No calls recorded")
+
+    # Prints the rows in the output format while they are read. For a table, empty_message is printed when there are
+    # no rows. Returns the number of rows printed
+    @staticmethod
+    def write_rows(rows, headers, output_format="table", empty_message=None):
+        if output_format == "jsonl":
+            lines = (json.dumps(dict((col, row.get(col)) for col in headers), default=str) for row in rows)
+            return Display.write_lines(lines)
+        if output_format == "csv":
+            return Display.write_lines(Display.csv_lines(rows, headers)) - 1
+        count = Display.stream_table(rows, headers)
+        if not count and empty_message is not None:
+            print(empty_message)
+        return count
+
+    # Returns the CSV lines of the rows, the header line first
+    @staticmethod
+    def csv_lines(rows, headers):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="")
+        for values in itertools.chain([headers], ([row.get(col, "") for col in headers] for row in rows)):
+            writer.writerow(values)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    # Writes the lines to standard output WRITE_BATCH_LINES at a time. Returns the number of lines
+    @staticmethod
+    def write_lines(lines):
+        batch = []
+        count = 0
+        for line in lines:
+            batch.append(line + "\n")
+            count += 1
+            if len(batch) >= WRITE_BATCH_LINES:
+                sys.stdout.write("".join(batch))
+                batch = []
+        sys.stdout.write("".join(batch))
+        return count
+
+    # Prints the rows as a table while they are read. The column widths come from the headers and the first
+    # WIDTH_SAMPLE_ROWS rows, so only that many rows are held at a time, and lines are written in batches. Returns the
+    # number of rows printed; nothing is printed for no rows
+    @staticmethod
+    def stream_table(rows, headers):
 
         """Author: Thierry Husson. Taken from stackoverflow
         https://stackoverflow.com/questions/17330139/python-printing-a-dictionary-as-a-horizontal-table-with-headers"""
 
+        rows = iter(rows)
+        sample = [[str(row.get(col, "")) for col in headers] for row in itertools.islice(rows, WIDTH_SAMPLE_ROWS)]
+        if not sample:
+            return 0
+        col_size = [max([len(header)] + [len(values[i]) for values in sample]) for i, header in enumerate(headers)]
+        format_str = ' | '.join(["{{:<{}}}".format(i) for i in col_size])
+        lines = [format_str.format(*headers), format_str.format(*['-' * i for i in col_size])]
+        count = 0
+        for values in itertools.chain(sample, ([str(row.get(col, "")) for col in headers] for row in rows)):
+            lines.append(format_str.format(*values))
+            count += 1
+            if len(lines) >= WRITE_BATCH_LINES:
+                sys.stdout.write("".join(line + "\n" for line in lines))
+                lines = []
+        lines.append("")
+        sys.stdout.write("".join(line + "\n" for line in lines))
+        return count
+
+    # Prints the rows as a table. The headers default to the keys of the first row
+    @staticmethod
+    def print_table(dictionary, headers=None):
         if not headers:
             headers = list(dictionary[0].keys() if dictionary else [])
-        my_list = [headers]
-        for item in dictionary:
-            my_list.append([str(item[col]) for col in headers])
-        col_size = [max(map(len, col)) for col in zip(*my_list)]
-        format_str = ' | '.join(["{{:<{}}}".format(i) for i in col_size])
-        my_list.insert(1, ['-' * i for i in col_size])
-        for item in my_list:
-            print(format_str.format(*item))
-        print()
+        Display.stream_table(dictionary, headers)
@@ -9,3 +9,24 @@ IP_ADDRESS_INVALID = 'IP address must be a valid ip'
 INTEGER_VALUE_INVALID = 'The value "{}" is not an integer'
 COMPATIBLE_MACHINE_UNAVAILABLE = 'No Resource available to host Instance "{}"'
 MIGRATION_NOT_POSSIBLE = 'Resources not available to migrate Instance "{}"'
+DUPLICATE_NAME = 'Name "{}" already exists'
+INSTANCE_ALREADY_EXISTS = 'Instance "{}" already exists'
+BATCH_LINE_INVALID = 'Line {} must be "INSTANCE_NAME IMAGE FLAVOR"'
+BATCH_SOURCE_MISSING = 'Either --file or --count is required'
+RACK_CACHE_CONFLICT = 'Image cache of rack "{}" is being changed by another command. Try again'
+SERVER_CAPACITY_CONFLICT = 'Free resources of the planned machines were changed by another command. Try again'
+RACK_CACHE_NOT_UPDATED = 'Instance "{}" was created but the image cache of rack "{}" was not updated: {}'
+CACHE_POLICY_NOT_FOUND = 'Cache policy "{}" not found. Valid policies are {}'
+TRACE_LINE_INVALID = 'Line {} of the trace is not a valid create, delete, remove or evacuate event'
+PAGE_INVALID = '--offset must not be negative and --limit must be at least 1'
+CONFIG_LINE_INVALID = 'Line {} of "{}": {}'
+CONFIG_FIELDS_INVALID = 'expected {} values, found {}'
+CONFIG_SECTION_SHORT = '"{}" ends at line {}, after {} of the {} lines announced'
+CONFIG_COUNT_MISSING = '"{}" ends at line {}, before the number of entries'
+CONFIG_LINES_REJECTED = '{} lines of "{}" were rejected. The other lines were loaded'
+SCRIPT_LINE_INVALID = 'Line {} of the script cannot be read: {}'
+SCRIPT_STOPPED = 'Stopped at line {} of the script'
+SCRIPT_LINES_FAILED = '{} commands of the script failed'
+PLACEMENT_CONFLICT = 'Servers able to host Instance "{}" kept being taken by other commands. Try again'
+WORKERS_INVALID = '--workers must be at least 1'
+DAEMON_ALREADY_RUNNING = 'A daemon is already listening on {}'
@@ -0,0 +1,187 @@
+"""Instrumentation of the DAO functions and the Controller static methods. install() replaces each of them with a
+wrapper that records, per function, the number of calls, the wall time, the documents returned and the database
+round trips. Listings that return cursors are counted, and timed, while the caller reads them. Calls made inside
+another instrumented call are recorded for both, so the times of DAO and Controller entries overlap.
+
+The totals of the process are shown by 'aggiestack admin stats'. A daemon keeps them across commands; a single
+command process keeps them in the file named by AGGIESTACK_STATS when it is set, and otherwise installs the wrappers
+only for '--profile'. '--profile' shows the calls of one command and '--profile-out FILE' also saves its cProfile
+statistics, readable with pstats.
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import DAO as dao
+from Controller import Controller
+
+STATS_FILE = os.path.abspath(os.environ['AGGIESTACK_STATS']) if os.environ.get('AGGIESTACK_STATS') else None
+
+# Fields kept for every instrumented function
+STAT_FIELDS = ("Calls", "Seconds", "MaxSeconds", "Documents", "RoundTrips")
+
+# DAO functions that only select or report on the backend. Counting them would only add noise
+NOT_INSTRUMENTED = ("backend", "use_backend", "round_trips", "add_write_listener")
+
+# Function name -> totals of the process
+totals = dict()
+
+# Totals of the command being profiled, or None
+_command = None
+
+_installed = False
+
+# Held while adding to the totals, which parallel workers (Scheduler) update at the same time
+_lock = threading.Lock()
+
+
+# Wraps the DAO functions and Controller static methods. Safe to call more than once
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    for name, value in list(vars(dao).items()):
+        if callable(value) and getattr(value, "__module__", None) == dao.__name__ and not name.startswith("_") \
+                and name not in NOT_INSTRUMENTED:
+            setattr(dao, name, _wrap("DAO." + name, value))
+    for name, value in list(vars(Controller).items()):
+        if isinstance(value, staticmethod):
+            setattr(Controller, name, staticmethod(_wrap("Controller." + name, value.__func__)))
+    if STATS_FILE is not None:
+        _load(STATS_FILE)
+        atexit.register(_save, STATS_FILE)
+
+
+def _wrap(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        round_trips = dao.round_trips()
+        started = time.perf_counter()
+        result = None
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            documents = _documents(result)
+            _record(name, time.perf_counter() - started, documents or 0, dao.round_trips() - round_trips)
+        return _counted(name, result) if documents is None else result
+    return wrapper
+
+
+# Returns the number of documents in the result, or None for a cursor or generator read later by the caller
+def _documents(result):
+    if isinstance(result, dict):
+        return 1
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    if isinstance(result, str) or not hasattr(result, "__iter__"):
+        return 0
+    return None
+
+
+# Yields the rows of the cursor, adding them and the time spent reading them to the function. The slowest call
+# (MaxSeconds) only covers the calls themselves
+def _counted(name, cursor):
+    cursor = iter(cursor)
+    while True:
+        round_trips = dao.round_trips()
+        started = time.perf_counter()
+        try:
+            row = next(cursor)
+        except StopIteration:
+            _record(name, time.perf_counter() - started, 0, dao.round_trips() - round_trips, calls=0)
+            return
+        _record(name, time.perf_counter() - started, 1, dao.round_trips() - round_trips, calls=0)
+        yield row
+
+
+def _record(name, seconds, documents, round_trips, calls=1):
+    with _lock:
+        _add(name, seconds, documents, round_trips, calls)
+
+
+def _add(name, seconds, documents, round_trips, calls):
+    for stats in (totals, _command):
+        if stats is None:
+            continue
+        entry = stats.get(name)
+        if entry is None:
+            entry = stats[name] = dict((field, 0) for field in STAT_FIELDS)
+        entry["Calls"] += calls
+        entry["Seconds"] += seconds
+        if calls:
+            entry["MaxSeconds"] = max(entry["MaxSeconds"], seconds)
+        entry["Documents"] += documents
+        entry["RoundTrips"] += max(round_trips, 0)
+
+
+# Runs method(*args) and returns the calls it made as rows for Display.display_stats. With profile_file the run is
+# also profiled with cProfile and the statistics are saved to that file
+def profile(method, args, profile_file=None):
+    global _command
+    _command = dict()
+    profiler = cProfile.Profile() if profile_file is not None else None
+    started = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.runcall(method, *args)
+        else:
+            method(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        if profiler is not None:
+            profiler.dump_stats(profile_file)
+        stats = _command
+        _command = None
+    return rows(stats, elapsed)
+
+
+# Returns the totals as rows, slowest first, with times in milliseconds. With elapsed, a first row holds the whole
+# command
+def rows(stats=None, elapsed=None):
+    stats = totals if stats is None else stats
+    result = []
+    if elapsed is not None:
+        result.append({"Call": "command", "Calls": 1, "Total_ms": _ms(elapsed), "Mean_ms": _ms(elapsed),
+                       "Max_ms": _ms(elapsed), "Documents": "-", "RoundTrips": "-"})
+    for name, entry in sorted(stats.items(), key=lambda item: item[1]["Seconds"], reverse=True):
+        calls = entry["Calls"]
+        result.append({"Call": name, "Calls": calls, "Total_ms": _ms(entry["Seconds"]),
+                       "Mean_ms": _ms(entry["Seconds"] / calls) if calls else "-",
+                       "Max_ms": _ms(entry["MaxSeconds"]), "Documents": entry["Documents"],
+                       "RoundTrips": entry["RoundTrips"]})
+    return result
+
+
+# Clears the totals, and the stats file when there is one
+def reset():
+    totals.clear()
+    if STATS_FILE is not None and os.path.exists(STATS_FILE):
+        os.remove(STATS_FILE)
+
+
+def _ms(seconds):
+    return "{:.3f}".format(seconds * 1000)
+
+
+# Adds the totals saved by earlier processes
+def _load(file_name):
+    if not os.path.exists(file_name):
+        return
+    try:
+        with open(file_name, "r") as f:
+            saved = json.load(f)
+    except ValueError:
+        return
+    for name, entry in saved.items():
+        totals[name] = dict((field, entry.get(field, 0)) for field in STAT_FIELDS)
+
+
+def _save(file_name):
+    if not totals:
+        return
+    with open(file_name, "w") as f:
+        json.dump(totals, f)
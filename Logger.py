@@ -1,29 +1,99 @@
-"""Logger Decorator. Wraps the methods and output the execution result in Log file 'AggiestackLogs.log.
+"""Logger Decorator. Wraps the methods and writes the outcome of each command to the Log file 'AggiestackLogs.log',
+one JSON record per line with the time taken and the number of database round trips.
 Example:
-    <2018 13:25:53> <SUCCESS> <aggiestack.py aggiestack show hardware>
-    <2018 13:43:56> <ERROR> <aggiestack.py aggiestack can_host dora small> <Exception:: Machine "dora" not found>
+    {"time": "2018-03-02 13:25:53", "level": "INFO", "command": "aggiestack.py show hardware", "outcome": "success",
+     "duration_ms": 4.812, "round_trips": 1}
+    {"time": "2018-03-02 13:43:56", "level": "ERROR", "command": "aggiestack.py admin can_host dora small",
+     "outcome": "error", "error": "Machine \"dora\" not found", "duration_ms": 1.207, "round_trips": 1}
+
+Commands only put their record on a queue. A background thread writes the records and rotates the file when it
+reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT older files next to it.
     """
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import DAO as dao
 
+LOG_FILE_NAME = os.environ.get('AGGIESTACK_LOG', 'AggiestackLogs.log')
+LOG_MAX_BYTES = int(os.environ.get('AGGIESTACK_LOG_MAX_BYTES', 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('AGGIESTACK_LOG_BACKUP_COUNT', 5))
 
-def logger(method):
-    import logging
-    import sys
+# Command line written to the log. Set by the caller when the command does not come from sys.argv
+command_line = None
+
+# Exception raised by the last logged method, or None if it succeeded
+last_error = None
+
+_log = logging.getLogger("aggiestack")
+
+# Thread writing the queued records to the log file. Started by the first decorated method
+_listener = None
+
+
+# Formats a record as one line of JSON: time and level, then the fields passed in the record's 'audit' attribute
+class JsonFormatter(logging.Formatter):
 
-    LOG_FILE_NAME = 'AggiestackLogs.log'
+    def format(self, record):
+        entry = {"time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"), "level": record.levelname}
+        entry.update(getattr(record, "audit", {}))
+        return json.dumps(entry, default=str)
 
-    logging.basicConfig(level=logging.INFO,
-                        format='<%(asctime)s> %(message)s',
-                        datefmt='%Y %H:%M:%S',
-                        filename=LOG_FILE_NAME)
+
+# Starts the background writer once per process. The file is opened on the first record, not here
+def start():
+    global _listener
+    if _listener is not None:
+        return
+    file_handler = logging.handlers.RotatingFileHandler(LOG_FILE_NAME, maxBytes=LOG_MAX_BYTES,
+                                                        backupCount=LOG_BACKUP_COUNT, delay=True)
+    file_handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+    _log.addHandler(logging.handlers.QueueHandler(records))
+    _log.setLevel(logging.INFO)
+    _log.propagate = False
+    atexit.register(stop)
+
+
+# Writes the records still queued and stops the background writer
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _log.handlers = []
+        _listener = None
+
+
+def logger(method):
+    start()
 
     def wrapper(*args):
-        command = ' '.join(sys.argv)
+        global last_error
+        command = ' '.join(command_line if command_line is not None else sys.argv)
+        started = time.perf_counter()
+        round_trips = dao.round_trips()
+        audit = {"command": command, "outcome": "interrupted"}
         try:
             result = method(*args)
-            logging.info("<SUCCESS> <{}>".format(command))
+            audit["outcome"] = "success"
             return result
         except Exception as e:
-            logging.error("<ERROR> <{}> <Exception:: {}>".format(command, e))
+            last_error = e
+            audit["outcome"] = "error"
+            audit["error"] = str(e)
             print(str(e))
+        finally:
+            audit["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            audit["round_trips"] = max(dao.round_trips() - round_trips, 0)
+            _log.log(logging.INFO if audit["outcome"] == "success" else logging.ERROR, audit["outcome"],
+                     extra={"audit": audit})
 
     return wrapper
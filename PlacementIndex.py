@@ -0,0 +1,151 @@
+import bisect
+
+# A query limited to at most 1 / PER_RACK_QUERY_SHARE of the racks scans their own lists. Any other query scans the
+# lists of all servers and skips the servers of racks it may not use
+PER_RACK_QUERY_SHARE = 4
+
+
+# Keeps the active servers ordered by free memory, disk and vcpu, with one sorted list per rack and one for all racks.
+# The best fit for a flavor is the smallest key that covers it. Bisecting on memory skips every server that is too
+# small on memory, so a query only scans servers that already have enough memory, and only in the racks it is allowed
+# to use. Servers are also ordered by free disk and by free vcpu, so when one of those is the scarce resource the
+# query scans the few servers that still have it instead. Servers out of some resource are kept aside, as only a
+# flavor that needs none of it can use them.
+class PlacementIndex:
+
+    def __init__(self, servers=()):
+        self._keys = dict()
+        self._rack_of = dict()
+        self._racks = dict()
+        self._all = []
+        self._by_disk = []
+        self._by_vcpu = []
+        self._exhausted = set()
+        # Number of servers looked at by the last best_fit
+        self.scanned = 0
+        for server in servers:
+            self.update(server)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    # Sort key of a server document. The name breaks ties so that keys are unique
+    @staticmethod
+    def key(server):
+        return server["Memory_free"], server["disk_free"], server["VCPU_free"], server["Name"]
+
+    # Adds the server or moves it to its new position. Inactive servers are dropped from the index
+    def update(self, server):
+        if not server.get("isActive", True):
+            self.remove(server["Name"])
+            return
+        self.set(server["Name"], server["Rack"], server["Memory_free"], server["disk_free"], server["VCPU_free"])
+
+    # Adds the active server or moves it to the position of its free resources, without a server document
+    def set(self, name, rack, memory_free, disk_free, vcpu_free):
+        self.remove(name)
+        key = (memory_free, disk_free, vcpu_free, name)
+        self._keys[name] = key
+        self._rack_of[name] = rack
+        if memory_free <= 0 or disk_free <= 0 or vcpu_free <= 0:
+            self._exhausted.add(name)
+            return
+        bisect.insort(self._racks.setdefault(rack, []), key)
+        bisect.insort(self._all, key)
+        bisect.insort(self._by_disk, (disk_free, name))
+        bisect.insort(self._by_vcpu, (vcpu_free, name))
+
+    # Removes the server from the index if present
+    def remove(self, name):
+        key = self._keys.pop(name, None)
+        if key is None:
+            return
+        rack = self._rack_of.pop(name)
+        if name in self._exhausted:
+            self._exhausted.discard(name)
+            return
+        keys = self._racks[rack]
+        del keys[bisect.bisect_left(keys, key)]
+        del self._all[bisect.bisect_left(self._all, key)]
+        del self._by_disk[bisect.bisect_left(self._by_disk, (key[1], name))]
+        del self._by_vcpu[bisect.bisect_left(self._by_vcpu, (key[2], name))]
+
+    # Returns the name of the smallest server that can host the given resources, or None. The search can be limited
+    # to racks, and racks in exclude_racks are skipped
+    def best_fit(self, memory, disk, vcpu, racks=None, exclude_racks=None):
+        if memory <= 0 or disk <= 0 or vcpu <= 0:
+            return self._best_fit_any(memory, disk, vcpu, racks, exclude_racks)
+        if racks is None or len(racks) * PER_RACK_QUERY_SHARE > len(self._racks):
+            return self._best_fit_all(memory, disk, vcpu, racks, exclude_racks)
+        best = None
+        self.scanned = 0
+        for rack in racks:
+            if exclude_racks is not None and rack in exclude_racks:
+                continue
+            keys = self._racks.get(rack)
+            if not keys:
+                continue
+            for i in range(bisect.bisect_left(keys, (memory,)), len(keys)):
+                key = keys[i]
+                if best is not None and key >= best:
+                    break
+                self.scanned += 1
+                if key[1] >= disk and key[2] >= vcpu:
+                    best = key
+                    break
+        return best[3] if best is not None else None
+
+    # Scans the servers with enough of the scarcest resource, the list whose bisect start is the largest. On memory the
+    # keys are in best fit order and the first match wins, so memory is also scanned when a match is expected sooner
+    # than the end of the shorter disk or vcpu list. On disk or vcpu every match is compared
+    def _best_fit_all(self, memory, disk, vcpu, racks, exclude_racks):
+        keys = self._all
+        rack_of = self._rack_of
+        start = bisect.bisect_left(keys, (memory,))
+        disk_start = bisect.bisect_left(self._by_disk, (disk,))
+        vcpu_start = bisect.bisect_left(self._by_vcpu, (vcpu,))
+        disk_count = len(keys) - disk_start
+        vcpu_count = len(keys) - vcpu_start
+        if not disk_count or not vcpu_count:
+            self.scanned = 0
+            return None
+        # The memory scan stops at its first match. When the resources are independent, about
+        # len(keys) ** 2 / (disk_count * vcpu_count) servers are looked at before one has enough disk and vcpu
+        if (start >= disk_start and start >= vcpu_start) or \
+                len(keys) ** 2 < disk_count * vcpu_count * min(disk_count, vcpu_count):
+            for i in range(start, len(keys)):
+                key = keys[i]
+                if key[1] >= disk and key[2] >= vcpu:
+                    rack = rack_of[key[3]]
+                    if (racks is None or rack in racks) and (exclude_racks is None or rack not in exclude_racks):
+                        self.scanned = i - start + 1
+                        return key[3]
+            self.scanned = len(keys) - start
+            return None
+        if disk_start >= vcpu_start:
+            candidates = self._by_disk[disk_start:]
+        else:
+            candidates = self._by_vcpu[vcpu_start:]
+        self.scanned = len(candidates)
+        best = None
+        for resource, name in candidates:
+            key = self._keys[name]
+            if key[0] >= memory and key[1] >= disk and key[2] >= vcpu and (best is None or key < best):
+                rack = rack_of[name]
+                if (racks is None or rack in racks) and (exclude_racks is None or rack not in exclude_racks):
+                    best = key
+        return best[3] if best is not None else None
+
+    # Best fit over every server, exhausted or not, for flavors that leave a resource unused
+    def _best_fit_any(self, memory, disk, vcpu, racks, exclude_racks):
+        self.scanned = len(self._keys)
+        best = None
+        for name, key in self._keys.items():
+            if key[0] >= memory and key[1] >= disk and key[2] >= vcpu and (best is None or key < best):
+                rack = self._rack_of[name]
+                if (racks is None or rack in racks) and (exclude_racks is None or rack not in exclude_racks):
+                    best = key
+        return best[3] if best is not None else None
@@ -0,0 +1,263 @@
+from models.Instance import Instance
+from PlacementIndex import PlacementIndex
+from RackCache import RackCache
+import Exceptions as exp
+import DAO as dao
+
+# Largest number of instances for which an exhaustive search is tried when best fit decreasing finds no packing
+EXACT_SOLVER_LIMIT = 10
+
+# Candidate servers the exhaustive search may try, over all its steps, before it gives up
+EXACT_SOLVER_STEPS = 200000
+
+
+# Writes computed by a Planner. DAO.apply_plan stores all of them at once, in a transaction when the store has them
+class Plan:
+
+    def __init__(self):
+        # Instance documents to insert
+        self.instances = []
+        # Instance name -> server the existing instance moves to
+        self.moves = dict()
+        # Instance name -> server the existing instance moves from
+        self.sources = dict()
+        # Servers to deactivate
+        self.deactivated = []
+        # Servers to delete
+        self.deleted = []
+        # Server name -> [memory, disk, vcpu] to add to the free capacity
+        self.server_deltas = dict()
+        # Rack name -> rack document whose cache fields (RackCache.FIELDS) must be stored
+        self.racks = dict()
+        # (image, rack) pairs to add to or remove from the ImageLookup table
+        self.lookup_added = set()
+        self.lookup_removed = set()
+        # Error messages of the requests that could not be placed
+        self.failures = []
+
+    def is_empty(self):
+        return not (self.instances or self.moves or self.deactivated or self.deleted or self.server_deltas or
+                    self.racks or self.lookup_added or self.lookup_removed)
+
+
+# Places many instances in one pass against an in-memory snapshot of the active servers, racks, flavors and images.
+# New instances follow the rules of Controller.create_instance_with_cache: prefer the racks that already cache the
+# image, then any other rack, and take the best fit server in each step. Moved instances take the best fit server
+# of the racks they may move to. Nothing is written until the plan is applied, so an infeasible plan costs no writes.
+class Planner:
+
+    def __init__(self):
+        self.flavors = dict((flavor["Name"], flavor) for flavor in dao.get_all_flavors(dao.FLAVOR_RESOURCE_FIELDS))
+        self.images = dict((image["Name"], image) for image in dao.get_all_images(RackCache.ENTRY_FIELDS))
+        self.servers = dict((server["Name"], server)
+                            for server in dao.get_all_servers(None, dao.SERVER_CAPACITY_FIELDS))
+        self.racks = dict((rack["Name"], rack) for rack in dao.get_all_racks(RackCache.READ_FIELDS))
+        self.index = PlacementIndex(self.servers.values())
+        self.lookup = dict()
+        for rack in self.racks.values():
+            for image in rack["ImageCache"]:
+                self.lookup.setdefault(image["Name"], set()).add(rack["Name"])
+        self.plan = Plan()
+        self._timestamp = None
+
+    # Returns the best fit server name for the flavor, limited to racks or skipping exclude_racks
+    def best_fit(self, flavor, racks=None, exclude_racks=None):
+        return self.index.best_fit(flavor["Memory"], flavor["Disk"], flavor["VCPU"], racks, exclude_racks)
+
+    # Places one instance and records the writes in the plan. Returns the server name, or None if no server fits
+    def place(self, name, flavor_name, image_name):
+        flavor = self.flavors[flavor_name]
+        cached_racks = self.lookup.get(image_name)
+        if cached_racks:
+            server = self.best_fit(flavor, cached_racks)
+            if server is None:
+                server = self.best_fit(flavor, exclude_racks=cached_racks)
+        else:
+            server = self.best_fit(flavor)
+        if server is None:
+            self.plan.failures.append(exp.COMPATIBLE_MACHINE_UNAVAILABLE.format(name))
+            return None
+        self.reserve(server, flavor)
+        self.cache_image(self.servers[server]["Rack"], image_name)
+        resources = list(Planner.demand(flavor))
+        self.plan.instances.append(Instance(name, flavor_name, image_name, server, resources).__dict__)
+        return server
+
+    # Moves an existing instance document to the given server, or to the best fit server of racks, or of any rack
+    # but exclude_racks. Returns the new server name, or None if no server fits
+    def move(self, instance, racks=None, exclude_racks=None, server=None):
+        flavor = self.resources(instance)
+        if server is None:
+            server = self.best_fit(flavor, racks, exclude_racks)
+        if server is None:
+            self.plan.failures.append(exp.MIGRATION_NOT_POSSIBLE.format(instance["Name"]))
+            return None
+        self.release(instance["Server"], flavor)
+        self.reserve(server, flavor)
+        self.cache_image(self.servers[server]["Rack"], instance["Image"])
+        self.plan.moves[instance["Name"]] = server
+        self.plan.sources[instance["Name"]] = instance["Server"]
+        return server
+
+    # Moves all the instance documents to servers of racks, or of any rack but exclude_racks. The instances are packed
+    # largest first with best fit decreasing, and when that fails a small set is searched exhaustively. Returns True if
+    # every instance was placed. Otherwise records the failure and leaves the planner unchanged
+    def move_all(self, instances, racks=None, exclude_racks=None):
+        candidates = [dict(server) for name, server in self.servers.items() if name in self.index and
+                      (racks is None or server["Rack"] in racks) and
+                      (exclude_racks is None or server["Rack"] not in exclude_racks)]
+        instances = list(instances)
+        instances = Planner.decreasing(instances, [self.resources(instance) for instance in instances], candidates)
+        demands = [Planner.demand(self.resources(instance)) for instance in instances]
+        assignment = Planner.best_fit_decreasing(demands, candidates)
+        if None in assignment and len(instances) <= EXACT_SOLVER_LIMIT:
+            exact = Planner.exact_fit(demands, candidates)
+            if exact is not None:
+                assignment = exact
+        if None in assignment:
+            self.plan.failures.append(exp.MIGRATION_NOT_POSSIBLE.format(instances[assignment.index(None)]["Name"]))
+            return False
+        for instance, server in zip(instances, assignment):
+            self.move(instance, server=server)
+        return True
+
+    # Returns the resources of the instance document like a flavor: those stamped on the instance, or those of its
+    # flavor for instances stored before the stamp existed
+    def resources(self, instance):
+        if instance.get("Resources") is None:
+            return self.flavors[instance["Flavor"]]
+        return dict(zip(("Memory", "Disk", "VCPU"), instance["Resources"]))
+
+    # Returns the (memory, disk, vcpu) the flavor needs
+    @staticmethod
+    def demand(flavor):
+        return flavor["Memory"], flavor["Disk"], flavor["VCPU"]
+
+    # Orders the instances largest first. The size of a flavor is the sum of its share of the total free memory,
+    # disk and vcpu of the candidate servers, so no single resource dominates the order
+    @staticmethod
+    def decreasing(instances, flavors, candidates):
+        totals = [max(sum(server[key] for server in candidates), 1) for key in ("Memory_free", "disk_free",
+                                                                                   "VCPU_free")]
+        sizes = dict((id(instance), sum(float(need) / total for need, total in zip(Planner.demand(flavor), totals)))
+                     for instance, flavor in zip(instances, flavors))
+        return sorted(instances, key=lambda instance: sizes[id(instance)], reverse=True)
+
+    # Packs the demands in order, each on the best fit server. Returns the server name of each demand, None for the
+    # demands that found no server. The candidate server documents are not changed
+    @staticmethod
+    def best_fit_decreasing(demands, candidates):
+        servers = dict((server["Name"], dict(server)) for server in candidates)
+        index = PlacementIndex(servers.values())
+        assignment = []
+        for memory, disk, vcpu in demands:
+            name = index.best_fit(memory, disk, vcpu)
+            assignment.append(name)
+            if name is not None:
+                server = servers[name]
+                server["Memory_free"] -= memory
+                server["disk_free"] -= disk
+                server["VCPU_free"] -= vcpu
+                index.update(server)
+        return assignment
+
+    # Searches all the assignments of the demands to the candidate servers. Servers that cannot host the smallest
+    # demand are dropped and the others sorted by free resources once, so the smallest server is tried first. Equal
+    # demands take servers in that order only, so the same packing is not searched again with the demands swapped, and
+    # servers with the same free resources as one already tried are skipped. Returns the server name of each demand,
+    # or None if there is no packing or the search tried EXACT_SOLVER_STEPS servers without finding one
+    @staticmethod
+    def exact_fit(demands, candidates):
+        order = sorted(range(len(demands)), key=lambda d: demands[d], reverse=True)
+        needs = [demands[d] for d in order]
+        smallest = [min(need[r] for need in needs) for r in range(3)]
+        servers = sorted([server["Memory_free"], server["disk_free"], server["VCPU_free"], server["Name"]]
+                         for server in candidates if server["Memory_free"] >= smallest[0] and
+                         server["disk_free"] >= smallest[1] and server["VCPU_free"] >= smallest[2])
+        for r in range(3):
+            if sum(server[r] for server in servers) < sum(need[r] for need in needs):
+                return None
+        placed = [None] * len(needs)
+        steps = [EXACT_SOLVER_STEPS]
+
+        def solve(i):
+            if i == len(needs):
+                return True
+            need = needs[i]
+            tried = set()
+            for j in range(placed[i - 1] if i and needs[i - 1] == need else 0, len(servers)):
+                steps[0] -= 1
+                if steps[0] < 0:
+                    return False
+                server = servers[j]
+                if server[0] < need[0] or server[1] < need[1] or server[2] < need[2]:
+                    continue
+                key = (server[0], server[1], server[2])
+                if key in tried:
+                    continue
+                tried.add(key)
+                for r in range(3):
+                    server[r] -= need[r]
+                placed[i] = j
+                if solve(i + 1):
+                    return True
+                for r in range(3):
+                    server[r] += need[r]
+            return False
+
+        if not solve(0):
+            return None
+        assignment = [None] * len(demands)
+        for position, d in enumerate(order):
+            assignment[d] = servers[placed[position]][3]
+        return assignment
+
+    # Excludes the server from further placements and deactivates it when the plan is applied
+    def deactivate(self, server_name):
+        self.index.remove(server_name)
+        self.plan.deactivated.append(server_name)
+
+    # Excludes the server from further placements and deletes it when the plan is applied
+    def delete(self, server_name):
+        self.index.remove(server_name)
+        self.plan.deleted.append(server_name)
+
+    # Gives the flavor resources back to the server
+    def release(self, server_name, flavor):
+        self.reserve(server_name, flavor, 1)
+
+    # Takes the flavor resources from the server in the snapshot and in the plan
+    def reserve(self, server_name, flavor, sign=-1):
+        server = self.servers.get(server_name)
+        if server is not None:
+            server["Memory_free"] += sign * flavor["Memory"]
+            server["disk_free"] += sign * flavor["Disk"]
+            server["VCPU_free"] += sign * flavor["VCPU"]
+            if server_name in self.index:
+                self.index.update(server)
+        delta = self.plan.server_deltas.setdefault(server_name, [0, 0, 0])
+        delta[0] += sign * flavor["Memory"]
+        delta[1] += sign * flavor["Disk"]
+        delta[2] += sign * flavor["VCPU"]
+
+    # Caches the image in the rack and keeps the image lookup in step with the evictions
+    def cache_image(self, rack_name, image_name):
+        rack = self.racks[rack_name]
+        self._timestamp = RackCache.next_timestamp(self._timestamp)
+        evicted, added = RackCache.admit(rack, self.images[image_name], self._timestamp)
+        for victim in evicted:
+            self.lookup[victim].discard(rack_name)
+            self._set_lookup(victim, rack_name, False)
+        if added:
+            self.lookup.setdefault(image_name, set()).add(rack_name)
+            self._set_lookup(image_name, rack_name, True)
+        self.plan.racks[rack_name] = rack
+
+    def _set_lookup(self, image_name, rack_name, cached):
+        pair = (image_name, rack_name)
+        self.plan.lookup_added.discard(pair)
+        self.plan.lookup_removed.discard(pair)
+        if cached:
+            self.plan.lookup_added.add(pair)
+        else:
+            self.plan.lookup_removed.add(pair)
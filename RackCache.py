@@ -0,0 +1,77 @@
+import datetime
+from CachePolicy import POLICIES, DEFAULT_POLICY
+
+
+# In-memory model of a rack image cache. Works on a rack document as returned by DAO and applies the eviction policy
+# selected for the rack (see CachePolicy). DAO.check_lru stores the result with a single update, and a Planner chains
+# several placements before anything is written.
+class RackCache:
+
+    # Rack fields changed by admit. These are the fields stored after the cache changes
+    FIELDS = ("ImageCache", "AvailableCapacity", "CacheState", "CacheStats")
+
+    # Rack fields admit reads
+    READ_FIELDS = ("Name", "Capacity", "CachePolicy", "CacheVersion") + FIELDS
+
+    # Image fields kept in a cache entry. The policies add their own fields to the entry
+    ENTRY_FIELDS = ("Name", "Size")
+
+    # Returns a timestamp strictly after previous, so images cached in the same batch keep their order
+    @staticmethod
+    def next_timestamp(previous=None):
+        now = datetime.datetime.utcnow()
+        if previous is not None and now <= previous:
+            now = previous + datetime.timedelta(microseconds=1)
+        return now
+
+    # Returns the eviction policy of the rack
+    @staticmethod
+    def policy(rack):
+        return POLICIES[rack.get("CachePolicy") or DEFAULT_POLICY]
+
+    # Returns the hit, miss and eviction counters of the rack, creating them if needed
+    @staticmethod
+    def stats(rack):
+        if rack.get("CacheStats") is None:
+            rack["CacheStats"] = dict()
+        stats = rack["CacheStats"]
+        for key in ("Hits", "Misses", "Evictions", "EvictedBytes"):
+            stats.setdefault(key, 0)
+        return stats
+
+    # Returns the fields of the rack document that admit may have changed
+    @staticmethod
+    def fields(rack):
+        return dict((field, rack.get(field)) for field in RackCache.FIELDS)
+
+    # Caches the image document in the rack document, evicting images chosen by the rack policy until it fits.
+    # Returns the names of the evicted images and whether the image was newly added. Images larger than the rack
+    # are counted as misses but not cached
+    @staticmethod
+    def admit(rack, image, timestamp):
+        policy = RackCache.policy(rack)
+        stats = RackCache.stats(rack)
+        if rack.get("CacheState") is None:
+            rack["CacheState"] = dict()
+        for entry in rack["ImageCache"]:
+            if entry["Name"] == image["Name"]:
+                stats["Hits"] += 1
+                policy.hit(rack, entry, timestamp)
+                return [], False
+        stats["Misses"] += 1
+        if rack["Capacity"] < image["Size"]:
+            return [], False
+        evicted = []
+        while rack["AvailableCapacity"] < image["Size"] and rack["ImageCache"]:
+            victim = policy.victim(rack, image)
+            rack["ImageCache"].remove(victim)
+            rack["AvailableCapacity"] += victim["Size"]
+            policy.evicted(rack, victim)
+            stats["Evictions"] += 1
+            stats["EvictedBytes"] += victim["Size"]
+            evicted.append(victim["Name"])
+        entry = dict((field, image[field]) for field in RackCache.ENTRY_FIELDS)
+        rack["ImageCache"].append(entry)
+        rack["AvailableCapacity"] -= image["Size"]
+        policy.insert(rack, entry, timestamp)
+        return evicted, True
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import deque
+import DAO as dao
+from Controller import Controller
+
+
+# Creates many instances in parallel. Every worker owns its own racks, no rack belonging to two workers, and places
+# its requests on them with Controller.create_instance_in_racks, so workers do not compete for the same servers or
+# rack image caches. A request only goes to the servers of the other workers, through
+# Controller.create_instance_with_cache, when none of the worker's racks can host it. Both take the server with the
+# same conditional update as 'server create'.
+#
+# The requests are split by rack affinity: images cached on racks that overlap (DAO.search_lookup) fall in the same
+# group together with those racks, and an image cached nowhere yet forms its own group without racks. Groups are
+# handed, largest first, to the least loaded worker; a group larger than a fair share is cut into shares, and its racks
+# are dealt out to the workers of the shares. The racks left over are dealt out to the workers with the fewest racks.
+# There are never more workers than racks, as the extra workers would only compete for the racks of the others. A
+# worker whose queue is empty takes requests from the end of the longest other queue and places them on its own racks.
+#
+# Threads are used rather than processes: the memory backend lives in the process, and with MongoDB the workers
+# mostly wait on the database, which releases the interpreter lock.
+class Scheduler:
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.queues = []
+        # Per worker: the racks it owns and the servers it placed instances on
+        self.racks = []
+        self.servers = []
+        # Per worker: racks owned, requests assigned, done, failed, taken from other queues and placed outside its racks
+        self.counts = []
+        self.partitions = 0
+        # Request index -> error message of the requests that failed
+        self.failures = dict()
+        self.queue_seconds = []
+        self.service_seconds = []
+        self._lock = threading.Lock()
+        self._submitted = None
+        # Released once every worker is running, so that no worker takes the requests of one not started yet
+        self._started = None
+
+    # Gives every worker its racks and its queue of the (instance name, image, flavor) requests. Each queued item is
+    # (request index, request)
+    def partition(self, requests):
+        all_racks = dao.get_valid_racks()
+        self.workers = max(1, min(self.workers, len(all_racks)))
+        self.queues = [deque() for worker in range(self.workers)]
+        self.racks = [set() for worker in range(self.workers)]
+        self.servers = [set() for worker in range(self.workers)]
+        self.counts = [dict(Worker=worker + 1, Racks=0, Assigned=0, Done=0, Failed=0, Stolen=0, Outside=0)
+                       for worker in range(self.workers)]
+        groups = Scheduler.affinity_groups(list(enumerate(requests)))
+        share = max(1, -(-len(requests) // self.workers))
+        for group_racks, items in sorted(groups.values(), key=lambda group: len(group[1]), reverse=True):
+            pieces = min(self.workers, -(-len(items) // share))
+            size = -(-len(items) // pieces)
+            owners = sorted(range(self.workers), key=lambda worker: len(self.queues[worker]))[:pieces]
+            for piece, worker in enumerate(owners):
+                self.queues[worker].extend(items[piece * size:(piece + 1) * size])
+                self.racks[worker].update(group_racks[piece::pieces])
+                self.partitions += 1
+        owned = set().union(*self.racks)
+        for rack in all_racks:
+            if rack not in owned:
+                min(self.racks, key=len).add(rack)
+        for worker in range(self.workers):
+            self.counts[worker]["Racks"] = len(self.racks[worker])
+            self.counts[worker]["Assigned"] = len(self.queues[worker])
+
+    # Groups the indexed requests by the racks caching their image. Racks are joined whenever one image is cached on
+    # both, so two groups never share a rack. Returns group key -> (racks of the group, indexed requests in their
+    # original order)
+    @staticmethod
+    def affinity_groups(indexed_requests):
+        parent = dict()
+
+        def root(rack):
+            while parent[rack] != rack:
+                parent[rack] = parent[parent[rack]]
+                rack = parent[rack]
+            return rack
+
+        racks_of = dict()
+        for index, (name, image, flavor) in indexed_requests:
+            if image in racks_of:
+                continue
+            racks_of[image] = racks = dao.search_lookup(image) or []
+            for rack in racks:
+                parent.setdefault(rack, rack)
+                parent[root(rack)] = root(racks[0])
+        groups = dict()
+        for rack in sorted(parent):
+            groups.setdefault(("Rack", root(rack)), ([], []))[0].append(rack)
+        for item in indexed_requests:
+            racks = racks_of[item[1][1]]
+            key = ("Rack", root(racks[0])) if racks else ("Image", item[1][1])
+            groups.setdefault(key, ([], []))[1].append(item)
+        return dict((key, group) for key, group in groups.items() if group[1])
+
+    # Runs the requests on the workers and returns the report shown by Display.display_schedule
+    def run(self, requests):
+        self.partition(requests)
+        self._submitted = time.perf_counter()
+        self._started = threading.Barrier(self.workers)
+        threads = [threading.Thread(target=self._work, args=(worker,), name="aggiestack-worker-{}".format(worker + 1))
+                   for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(len(requests), time.perf_counter() - self._submitted)
+
+    def _work(self, worker):
+        self._started.wait()
+        while True:
+            item, stolen = self._next(worker)
+            if item is None:
+                return
+            index, (name, image, flavor) = item
+            started = time.perf_counter()
+            server = error = None
+            try:
+                server = Controller.create_instance_in_racks(name, flavor, image, self.racks[worker])
+                if server is None:
+                    Controller.create_instance_with_cache(name, flavor, image)
+            except Exception as e:
+                error = str(e)
+            finished = time.perf_counter()
+            with self._lock:
+                self.queue_seconds.append(started - self._submitted)
+                self.service_seconds.append(finished - started)
+                counts = self.counts[worker]
+                counts["Done"] += 1
+                counts["Stolen"] += stolen
+                if error is not None:
+                    counts["Failed"] += 1
+                    self.failures[index] = error
+                elif server is None:
+                    counts["Outside"] += 1
+                else:
+                    self.servers[worker].add(server)
+
+    # Returns the next item of the worker's queue, else one taken from the end of the longest other queue, with 1 if
+    # it was taken. Returns (None, 0) when every queue is empty
+    def _next(self, worker):
+        try:
+            return self.queues[worker].popleft(), 0
+        except IndexError:
+            pass
+        for queue in sorted(self.queues, key=len, reverse=True):
+            try:
+                return queue.pop(), 1
+            except IndexError:
+                continue
+        return None, 0
+
+    def report(self, requests, elapsed):
+        failed = len(self.failures)
+        summary = {"Workers": self.workers, "Requests": requests, "Created": requests - failed, "Failed": failed,
+                   "Partitions": self.partitions, "Seconds": "{:.3f}".format(elapsed),
+                   "Per_sec": "{:.1f}".format(requests / elapsed) if elapsed else "-",
+                   "Queue_p50_ms": Scheduler.percentile_ms(self.queue_seconds, 0.50),
+                   "Queue_p99_ms": Scheduler.percentile_ms(self.queue_seconds, 0.99),
+                   "Service_p50_ms": Scheduler.percentile_ms(self.service_seconds, 0.50),
+                   "Service_p99_ms": Scheduler.percentile_ms(self.service_seconds, 0.99)}
+        workers = [dict(counts, Servers=len(self.servers[worker])) for worker, counts in enumerate(self.counts)]
+        return {"Summary": summary, "Workers": workers,
+                "Failures": [self.failures[index] for index in sorted(self.failures)]}
+
+    # Returns the q quantile of the seconds in milliseconds
+    @staticmethod
+    def percentile_ms(seconds, q):
+        if not seconds:
+            return "-"
+        seconds = sorted(seconds)
+        return "{:.3f}".format(seconds[min(len(seconds) - 1, int(round(q * (len(seconds) - 1))))] * 1000)
@@ -0,0 +1,259 @@
+from array import array
+from PlacementIndex import PlacementIndex
+from Planner import Planner, EXACT_SOLVER_LIMIT
+from RackCache import RackCache
+import sys
+import time
+import Exceptions as exp
+import DAO as dao
+
+# Resources tracked per server, in the order of the free capacity arrays
+RESOURCES = ("Memory", "Disk", "VCPU")
+
+# Failure messages kept for the report. Later failures are only counted
+REPORTED_FAILURES = 10
+
+
+# What-if model of the data center. Loads the current racks, servers, flavors, images and instances once and replays
+# a workload trace against them without writing anything. Placement uses the same rules as
+# Controller.create_instance_with_cache and the same best fit order as DAO.find_best_fit (PlacementIndex), caching
+# follows DAO.check_lru (RackCache), and remove and evacuate pack their instances like the Planner does.
+#
+# Server state is kept in arrays indexed by a slot number, so a large data center costs a few machine words per
+# server. Trace lines are
+#     create INSTANCE FLAVOR IMAGE
+#     delete INSTANCE
+#     remove MACHINE
+#     evacuate RACK
+class Simulator:
+
+    def __init__(self):
+        self.flavors = dict((flavor["Name"], (flavor["Memory"], flavor["Disk"], flavor["VCPU"]))
+                            for flavor in dao.get_all_flavors(dao.FLAVOR_RESOURCE_FIELDS))
+        self.images = dict((image["Name"], image) for image in dao.get_all_images(RackCache.ENTRY_FIELDS))
+        self.racks = dict((rack["Name"], rack) for rack in dao.get_all_racks(RackCache.READ_FIELDS))
+        self.names = []
+        self.slots = dict()
+        self.rack_of = []
+        self.total = [array('l') for resource in RESOURCES]
+        self.free = [array('l') for resource in RESOURCES]
+        self.active = array('b')
+        self.index = PlacementIndex()
+        for server in dao.get_all_valid_server(dao.SERVER_CAPACITY_FIELDS + list(RESOURCES)):
+            self._add_server(server)
+        # Instance name -> (slot, flavor name, image name), and the instance names of each slot
+        self.instances = dict()
+        self.hosted = [dict() for name in self.names]
+        for instance in dao.get_all_instances(None, ["Name", "Server", "Flavor", "Image"]):
+            slot = self.slots.get(instance["Server"])
+            if slot is not None:
+                self.instances[instance["Name"]] = (slot, instance["Flavor"], instance["Image"])
+                self.hosted[slot][instance["Name"]] = None
+        self.lookup = dict()
+        for rack in self.racks.values():
+            for image in rack["ImageCache"]:
+                self.lookup.setdefault(image["Name"], set()).add(rack["Name"])
+        self.counters = dict((key, 0) for key in ("Events", "Creates", "Placed", "CreateFailures", "Deletes",
+                                                  "Removes", "Evacuations", "MigrationFailures", "Moves"))
+        self.failures = []
+        self._cache_start = self._cache_counters()
+        self._timestamp = None
+
+    def _add_server(self, server):
+        slot = len(self.names)
+        self.names.append(server["Name"])
+        self.slots[server["Name"]] = slot
+        self.rack_of.append(server["Rack"])
+        for i, key in enumerate(("Memory", "Disk", "VCPU")):
+            self.total[i].append(server[key])
+        for i, key in enumerate(("Memory_free", "disk_free", "VCPU_free")):
+            self.free[i].append(server[key])
+        self.active.append(1 if server["isActive"] else 0)
+        if server["isActive"]:
+            self._index(slot)
+
+    def _index(self, slot):
+        self.index.set(self.names[slot], self.rack_of[slot], self.free[0][slot], self.free[1][slot],
+                       self.free[2][slot])
+
+    def _cache_counters(self):
+        hits = misses = 0
+        for rack in self.racks.values():
+            stats = RackCache.stats(rack)
+            hits += stats["Hits"]
+            misses += stats["Misses"]
+        return hits, misses
+
+    # Replays the trace file, or standard input for '-', and returns the report
+    def run(self, file_name):
+        f = sys.stdin if file_name == '-' else open(file_name, "r")
+        started = time.perf_counter()
+        try:
+            for line_number, line in enumerate(f, 1):
+                line = line.split('#')[0].split()
+                if line:
+                    self.replay(line, line_number)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        return self.report(time.perf_counter() - started)
+
+    # Applies one trace event given as its words. Raises on a line that is not an event; an event naming a flavor,
+    # image or rack that does not exist is counted as failed, like one that cannot be placed
+    def replay(self, words, line_number=0):
+        op = words[0]
+        if op == "create" and len(words) == 4:
+            self.create(words[1], words[2], words[3])
+        elif op == "delete" and len(words) == 2:
+            self.delete(words[1])
+        elif op == "remove" and len(words) == 2:
+            self.remove(words[1])
+        elif op == "evacuate" and len(words) == 2:
+            self.evacuate(words[1])
+        else:
+            raise Exception(exp.TRACE_LINE_INVALID.format(line_number))
+        self.counters["Events"] += 1
+
+    # Places a new instance: racks caching the image first, then the other racks
+    def create(self, name, flavor_name, image_name):
+        self.counters["Creates"] += 1
+        if name in self.instances:
+            self._fail("CreateFailures", exp.INSTANCE_ALREADY_EXISTS.format(name))
+            return
+        if flavor_name not in self.flavors:
+            self._fail("CreateFailures", exp.FLAVOR_NOT_FOUND.format(flavor_name))
+            return
+        if image_name not in self.images:
+            self._fail("CreateFailures", exp.IMAGE_NOT_FOUND.format(image_name))
+            return
+        memory, disk, vcpu = self.flavors[flavor_name]
+        cached_racks = self.lookup.get(image_name)
+        if cached_racks:
+            server = self.index.best_fit(memory, disk, vcpu, cached_racks)
+            if server is None:
+                server = self.index.best_fit(memory, disk, vcpu, exclude_racks=cached_racks)
+        else:
+            server = self.index.best_fit(memory, disk, vcpu)
+        if server is None:
+            self._fail("CreateFailures", exp.COMPATIBLE_MACHINE_UNAVAILABLE.format(name))
+            return
+        self._host(name, self.slots[server], flavor_name, image_name)
+        self.counters["Placed"] += 1
+
+    # Deletes an instance and gives its resources back. Unknown instances are ignored
+    def delete(self, name):
+        self.counters["Deletes"] += 1
+        instance = self.instances.pop(name, None)
+        if instance is not None:
+            slot, flavor_name, image_name = instance
+            del self.hosted[slot][name]
+            self._reserve(slot, flavor_name, 1)
+
+    # Moves the instances of the machine to the other active machines and drops it. Nothing changes if they do not fit
+    def remove(self, server_name):
+        self.counters["Removes"] += 1
+        slot = self.slots.get(server_name)
+        if slot is None or not self.active[slot]:
+            return
+        candidates = [other for other in range(len(self.names)) if self.active[other] and other != slot]
+        if self._move_all(list(self.hosted[slot]), candidates):
+            self._deactivate(slot)
+
+    # Moves the instances of the rack to the active machines of the other racks and deactivates its machines.
+    # Nothing changes if they do not fit
+    def evacuate(self, rack_name):
+        self.counters["Evacuations"] += 1
+        if rack_name not in self.racks:
+            self._fail("MigrationFailures", exp.RACK_NOT_FOUND.format(rack_name))
+            return
+        slots = [slot for slot in range(len(self.names)) if self.rack_of[slot] == rack_name and self.active[slot]]
+        candidates = [slot for slot in range(len(self.names)) if self.rack_of[slot] != rack_name and self.active[slot]]
+        names = [name for slot in slots for name in self.hosted[slot]]
+        if self._move_all(names, candidates):
+            for slot in slots:
+                self._deactivate(slot)
+
+    # Packs the instances on the candidate slots like Planner.move_all. Returns False, changing nothing, if they do
+    # not all fit
+    def _move_all(self, names, candidates):
+        if not names:
+            return True
+        servers = [{"Name": self.names[slot], "Rack": self.rack_of[slot], "Memory_free": self.free[0][slot],
+                    "disk_free": self.free[1][slot], "VCPU_free": self.free[2][slot]} for slot in candidates]
+        flavors = [dict(zip(RESOURCES, self.flavors[self.instances[name][1]])) for name in names]
+        names = Planner.decreasing(names, flavors, servers)
+        demands = [self.flavors[self.instances[name][1]] for name in names]
+        assignment = Planner.best_fit_decreasing(demands, servers)
+        if None in assignment and len(names) <= EXACT_SOLVER_LIMIT:
+            assignment = Planner.exact_fit(demands, servers) or assignment
+        if None in assignment:
+            self._fail("MigrationFailures", exp.MIGRATION_NOT_POSSIBLE.format(names[assignment.index(None)]))
+            return False
+        for name, server in zip(names, assignment):
+            slot, flavor_name, image_name = self.instances.pop(name)
+            del self.hosted[slot][name]
+            self._reserve(slot, flavor_name, 1)
+            self._host(name, self.slots[server], flavor_name, image_name)
+            self.counters["Moves"] += 1
+        return True
+
+    def _host(self, name, slot, flavor_name, image_name):
+        self._reserve(slot, flavor_name, -1)
+        self.instances[name] = (slot, flavor_name, image_name)
+        self.hosted[slot][name] = None
+        self._cache_image(self.rack_of[slot], image_name)
+
+    def _reserve(self, slot, flavor_name, sign):
+        memory, disk, vcpu = self.flavors[flavor_name]
+        self.free[0][slot] += sign * memory
+        self.free[1][slot] += sign * disk
+        self.free[2][slot] += sign * vcpu
+        if self.active[slot]:
+            self._index(slot)
+
+    def _deactivate(self, slot):
+        self.active[slot] = 0
+        self.index.remove(self.names[slot])
+
+    def _cache_image(self, rack_name, image_name):
+        self._timestamp = RackCache.next_timestamp(self._timestamp)
+        evicted, added = RackCache.admit(self.racks[rack_name], self.images[image_name], self._timestamp)
+        for victim in evicted:
+            self.lookup[victim].discard(rack_name)
+        if added:
+            self.lookup.setdefault(image_name, set()).add(rack_name)
+
+    def _fail(self, counter, message):
+        self.counters[counter] += 1
+        if len(self.failures) < REPORTED_FAILURES:
+            self.failures.append(message)
+
+    # Returns the summary of the simulation: event counters, cache hit rate, and for every resource the total, used
+    # and utilization of the active machines plus the fragmentation, the share of the free capacity left on machines
+    # that cannot host any flavor. Headroom is how many more instances of each flavor would still fit
+    def report(self, elapsed=0.0):
+        hits, misses = self._cache_counters()
+        hits -= self._cache_start[0]
+        misses -= self._cache_start[1]
+        summary = dict(self.counters)
+        summary["CacheHitRate"] = "{:.2%}".format(float(hits) / (hits + misses)) if hits + misses else "-"
+        summary["Seconds"] = "{:.3f}".format(elapsed)
+        summary["EventsPerSecond"] = int(summary["Events"] / elapsed) if elapsed else "-"
+        active = [slot for slot in range(len(self.names)) if self.active[slot]]
+        demands = list(self.flavors.values())
+        stranded = [slot for slot in active
+                    if not any(all(self.free[i][slot] >= need[i] for i in range(3)) for need in demands)]
+        resources = []
+        for i, resource in enumerate(RESOURCES):
+            total = sum(self.total[i][slot] for slot in active)
+            free = sum(self.free[i][slot] for slot in active)
+            lost = sum(self.free[i][slot] for slot in stranded)
+            resources.append({"Resource": resource, "Total": total, "Used": total - free,
+                              "Utilization": "{:.2%}".format(float(total - free) / total) if total else "-",
+                              "Fragmentation": "{:.2%}".format(float(lost) / free) if free else "-"})
+        headroom = []
+        for flavor_name, need in sorted(self.flavors.items()):
+            fits = sum(min(self.free[i][slot] // need[i] if need[i] else sys.maxsize for i in range(3))
+                       for slot in active)
+            headroom.append({"Flavor": flavor_name, "Fits": fits})
+        return {"Summary": summary, "Resources": resources, "Headroom": headroom, "Failures": self.failures}
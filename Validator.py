@@ -1,10 +1,39 @@
 import DAO as dao
+from CachePolicy import POLICIES
 import Exceptions as exp
 import re
+import time
+
+# Seconds a name found in the database is trusted without asking again
+NAME_CACHE_TTL = 5
 
 
 class Validator:
 
+    # Collection name -> (time cached, names known to exist). A collection is dropped when it is written to
+    _known_names = dict()
+
+    @staticmethod
+    # Returns True if the name exists in the collection. Names already found are answered from the cache, others are
+    # looked up with the indexed exists query and cached when found
+    def _exists(collection, name, exists):
+        now = time.monotonic()
+        known = Validator._known_names.get(collection)
+        if known is None or now - known[0] > NAME_CACHE_TTL:
+            known = (now, set())
+            Validator._known_names[collection] = known
+        if name in known[1]:
+            return True
+        if exists(name):
+            known[1].add(name)
+            return True
+        return False
+
+    @staticmethod
+    # Forgets the cached names of the collection. Registered with DAO as a write listener
+    def invalidate(collection):
+        Validator._known_names.pop(collection, None)
+
     @staticmethod
     # This method validates and converts the value in string to an integer.
     def validate_int_value(value):
@@ -29,37 +58,55 @@ class Validator:
     @staticmethod
     # This method validates if the image is a valid image present int the database
     def validate_image(image):
-        images = dao.get_valid_images()
-        if image not in images:
+        if not Validator._exists("Images", image, dao.image_exists):
             raise Exception(exp.IMAGE_NOT_FOUND.format(image))
         return image
 
     @staticmethod
     # This method validates if the flavor is a valid flavor present in the database
     def validate_flavor(flavor):
-        flavors = dao.get_valid_flavors()
-        if flavor not in flavors:
+        if not Validator._exists("Flavors", flavor, dao.flavor_exists):
             raise Exception(exp.FLAVOR_NOT_FOUND.format(flavor))
         return flavor
 
     @staticmethod
     def validate_server(server):
-        servers = dao.get_valid_server()
-        if server not in servers:
+        if not Validator._exists("Servers", server, dao.server_exists):
             raise Exception(exp.MACHINE_NOT_FOUND.format(server))
         return server
 
     @staticmethod
     # This method validates if the instance is currently present
     def validate_instance(instance):
-        instances = dao.get_all_instances_name()
-        if instance not in instances:
+        if not Validator._exists("Instances", instance, dao.instance_exists):
             raise Exception(exp.INSTANCE_NOT_FOUND.format(instance))
         return instance
 
+    @staticmethod
+    # This method validates a batch of (instance name, image, flavor) requests. Existing names are found with one
+    # query for the whole batch
+    def validate_instance_requests(requests):
+        instances = set(dao.get_existing_instance_names([request[0] for request in requests]))
+        for name, image, flavor in requests:
+            Validator.validate_flavor(flavor)
+            Validator.validate_image(image)
+            if name in instances:
+                raise Exception(exp.INSTANCE_ALREADY_EXISTS.format(name))
+            instances.add(name)
+        return requests
+
+    @staticmethod
+    # This method validates the name of a rack image cache eviction policy
+    def validate_cache_policy(policy):
+        if policy not in POLICIES:
+            raise Exception(exp.CACHE_POLICY_NOT_FOUND.format(policy, ", ".join(sorted(POLICIES))))
+        return policy
+
     @staticmethod
     def validate_rack(rack):
-        racks = dao.get_valid_racks()
-        if rack not in racks:
+        if not Validator._exists("Racks", rack, dao.rack_exists):
             raise Exception(exp.RACK_NOT_FOUND.format(rack))
         return rack
+
+
+dao.add_write_listener(Validator.invalidate)
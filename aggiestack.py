@@ -1,10 +1,15 @@
 import sys
 import argparse
+import shlex
+import time
 from Validator import Validator as validator
-from Display import Display
+from Display import Display, FORMATS
 import Logger as log
 import Exceptions as exp
 from Controller import Controller
+from Scheduler import Scheduler
+import Daemon
+import Instrumentation
 
 
 # Global variable used to initialize admin privilege
@@ -28,40 +33,60 @@ def config(args):
         Controller.create_racks_servers(args.hardware)
 
 
+# Returns the (offset, limit) page selected by the --offset and --limit options
+def page(args):
+    offset = validator.validate_int_value(args.offset) if args.offset is not None else 0
+    limit = validator.validate_int_value(args.limit) if args.limit is not None else None
+    if offset < 0 or (limit is not None and limit < 1):
+        raise ValueError(exp.PAGE_INVALID)
+    return offset, limit
+
+
+# Adds the --offset and --limit paging options to a listing command
+def add_paging(command):
+    command.add_argument("--offset", help="number of rows to skip")
+    command.add_argument("--limit", help="maximum number of rows to show")
+
+
+# Adds the --format option to a show command
+def add_format(command):
+    command.add_argument("--format", choices=FORMATS, default="table", help="output format")
+
+
 # Displays list of hardware.
 @log.logger
 def show_hardware(args):
     if is_admin():
-        Display.display_servers(True)
+        Display.display_servers(True, *page(args), output_format=args.format)
     else:
-        Display.display_servers()
+        Display.display_servers(False, *page(args), output_format=args.format)
 
 
 # Displays list of Images.
 @log.logger
 def show_images(args):
-    Display.display_images()
+    Display.display_images(*page(args), output_format=args.format)
 
 
 # Displays list of flavors.
 @log.logger
 def show_flavors(args):
-    Display.display_flavors()
+    Display.display_flavors(*page(args), output_format=args.format)
 
 
 # Displays everything
 @log.logger
 def show_all(args):
-    Display.display_flavors()
-    Display.display_images()
-    Display.display_servers()
+    Display.display_flavors(output_format=args.format)
+    Display.display_images(output_format=args.format)
+    Display.display_servers(output_format=args.format)
 
 
 # Displays list of instances.
 @log.logger
 def show_instances(args):
     if is_admin():
-        Display.display_instances(True)
+        Display.display_instances(True, *page(args), output_format=args.format)
     else:
         raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
 
@@ -71,7 +96,26 @@ def show_instances(args):
 def show_image_cache(args):
     if is_admin():
         rack = validator.validate_rack(args.rack_name)
-        Display.display_image_cache(rack)
+        Display.display_image_cache(rack, args.format)
+    else:
+        raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
+
+
+# Displays how many more instances of every flavor the data center can host
+@log.logger
+def show_capacity(args):
+    if is_admin():
+        Display.display_capacity(Controller.capacity_report(), args.format)
+    else:
+        raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
+
+
+# Selects the eviction policy of a rack image cache
+@log.logger
+def set_cache_policy(args):
+    if is_admin():
+        Controller.set_cache_policy(validator.validate_rack(args.rack_name),
+                                    validator.validate_cache_policy(args.policy))
     else:
         raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
 
@@ -79,7 +123,7 @@ def show_image_cache(args):
 # Displays all the instances running
 @log.logger
 def display_server(args):
-    Display.display_instances()
+    Display.display_instances(False, *page(args), output_format=args.format)
 
 
 # Creates new instance. Validates the inputs before proceeding
@@ -89,6 +133,26 @@ def create_server(args):
                                           validator.validate_image(args.image))
 
 
+# Creates many instances in one pass, from a request file or from a name prefix and a count. With --workers the
+# instances are placed one by one by that many parallel workers instead
+@log.logger
+def create_server_batch(args):
+    if args.count is not None:
+        count = validator.validate_int_value(args.count)
+        requests = [("{}-{}".format(args.prefix, i + 1), args.image, args.flavor) for i in range(count)]
+    elif args.file is not None:
+        requests = Controller.read_instance_requests(args.file)
+    else:
+        raise Exception(exp.BATCH_SOURCE_MISSING)
+    if args.workers is not None:
+        workers = validator.validate_int_value(args.workers)
+        if workers < 1:
+            raise ValueError(exp.WORKERS_INVALID)
+        Display.display_schedule(Scheduler(workers).run(validator.validate_instance_requests(requests)))
+    else:
+        Controller.create_instances_batch(validator.validate_instance_requests(requests))
+
+
 # Deletes the instance
 @log.logger
 def delete_server(args):
@@ -118,29 +182,114 @@ def add_machine(args):
         raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
 
 
-# Removes the machine from data center view. Migrates all the running instance before migrating
+# Removes the machine from data center view. Migrates all the running instance before migrating. The planned moves
+# are shown first, and with --dry-run nothing is changed
 @log.logger
 def remove_machine(args):
     if is_admin():
-        Controller.remove_server(validator.validate_server(args.server_name))
+        plan = Controller.plan_server_removal(validator.validate_server(args.server_name))
+        Display.display_plan(plan)
+        if not args.dry_run:
+            Controller.apply_plan(plan)
+    else:
+        raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
+
+
+# Creates the database indexes and records the schema version
+@log.logger
+def init_db(args):
+    if is_admin():
+        Controller.initialize_tables()
+    else:
+        raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
+
+
+# Replays a workload trace against an in-memory copy of the data center and shows the resulting utilization,
+# fragmentation, cache hit rate and failures. Nothing is written
+@log.logger
+def simulate(args):
+    if is_admin():
+        Display.display_simulation(Controller.simulate(args.trace))
     else:
         raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
 
 
-# Evacuates all the instances in the rack to another rack.
+# Evacuates all the instances in the rack to another rack. The planned moves are shown first, and with --dry-run
+# nothing is changed
 @log.logger
 def evacuate_rack(args):
     if is_admin():
         rack_name = validator.validate_rack(args.rack_name)
-        Controller.migrate_rack(validator.validate_rack(rack_name))
+        plan = Controller.plan_rack_evacuation(rack_name)
+        Display.display_plan(plan)
+        if not args.dry_run:
+            Controller.apply_plan(plan)
     else:
         raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
 
 
-def main(argv):
-    Controller.initialize_tables()
+# Displays the calls, time, documents and round trips counted for every DAO function and Controller method
+@log.logger
+def show_stats(args):
+    if is_admin():
+        Display.display_stats(Instrumentation.rows(), args.format)
+        if args.reset:
+            Instrumentation.reset()
+    else:
+        raise Exception(exp.ADMIN_PRIVILEGE_REQUIRED)
+
+
+# Runs the 'aggiestack ...' lines of the script, or of standard input for '-', one after the other in this process,
+# so the database connection and the caches are set up once. Blank lines and '#' comments are skipped. With --timing
+# the outcome and time of every line are printed after its output. With --stop-on-error the first failed line ends
+# the script
+def run_script(args):
+    f = sys.stdin if args.script == '-' else open(args.script, "r")
+    commands = failed = 0
+    started = time.perf_counter()
+    try:
+        for line_number, line in enumerate(f, 1):
+            line_started = time.perf_counter()
+            try:
+                words = shlex.split(line, comments=True)
+            except ValueError as e:
+                print(exp.SCRIPT_LINE_INVALID.format(line_number, e))
+                words = None
+            if words and words[0] == 'aggiestack':
+                words = words[1:]
+            if words == []:
+                continue
+            commands += 1
+            ok = words is not None and execute(words)
+            if args.timing:
+                print("# line {}: {} in {:.3f} ms".format(line_number, "ok" if ok else "failed",
+                                                         (time.perf_counter() - line_started) * 1000))
+            if not ok:
+                failed += 1
+                if args.stop_on_error:
+                    print(exp.SCRIPT_STOPPED.format(line_number))
+                    break
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    if args.timing:
+        print("# {} commands, {} failed, in {:.3f} ms".format(commands, failed, (time.perf_counter() - started) * 1000))
+    log.last_error = Exception(exp.SCRIPT_LINES_FAILED.format(failed)) if failed else None
+
+
+# Parser of every command. Built once per process
+_parser = None
+
+
+# Builds the command line parser on first use
+def build_parser():
+    global _parser
+    if _parser is not None:
+        return _parser
 
     parser = argparse.ArgumentParser(prog='aggiestack')
+    parser.add_argument("--profile", action="store_true", help="show the calls made by the command")
+    parser.add_argument("--profile-out", metavar="FILE", help="also save the cProfile statistics of the command")
     sub_parser = parser.add_subparsers(help='commands can be config, show')
 
     config_command = sub_parser.add_parser('config', help='configure')
@@ -154,24 +303,43 @@ def main(argv):
     show_sub_parser = show_command.add_subparsers(help='display image cache')
 
     show_hardware_command = show_sub_parser.add_parser('hardware', help='display hardware')
+    add_paging(show_hardware_command)
+    add_format(show_hardware_command)
     show_hardware_command.set_defaults(func=show_hardware)
 
     show_images_command = show_sub_parser.add_parser('images', help='display images')
+    add_paging(show_images_command)
+    add_format(show_images_command)
     show_images_command.set_defaults(func=show_images)
 
     show_flavors_command_ = show_sub_parser.add_parser('flavors', help='display flavors')
+    add_paging(show_flavors_command_)
+    add_format(show_flavors_command_)
     show_flavors_command_.set_defaults(func=show_flavors)
 
     show_hardware_command = show_sub_parser.add_parser('all', help='display all hardware, images and flavors')
+    add_format(show_hardware_command)
     show_hardware_command.set_defaults(func=show_all)
 
     show_hardware_command = show_sub_parser.add_parser('instances', help='display instances')
+    add_paging(show_hardware_command)
+    add_format(show_hardware_command)
     show_hardware_command.set_defaults(func=show_instances)
 
     image_cache_command = show_sub_parser.add_parser('imagecaches', help='create cached images')
     image_cache_command.add_argument('rack_name', help="Rack Name")
+    add_format(image_cache_command)
     image_cache_command.set_defaults(func=show_image_cache)
 
+    capacity_command = show_sub_parser.add_parser('capacity', help='display how many instances of each flavor fit')
+    add_format(capacity_command)
+    capacity_command.set_defaults(func=show_capacity)
+
+    cache_policy_command = sub_parser.add_parser('cache-policy', help='select image cache eviction policy')
+    cache_policy_command.add_argument('rack_name', help="Rack Name")
+    cache_policy_command.add_argument('policy', help="LRU, LFU, GDS or ARC")
+    cache_policy_command.set_defaults(func=set_cache_policy)
+
     can_host_command = sub_parser.add_parser('can_host', help='can_host flavor on machine')
     can_host_command.add_argument("machine_name", help="machine name")
     can_host_command.add_argument("flavor", help="flavor name")
@@ -179,12 +347,26 @@ def main(argv):
 
     evacuate_command = sub_parser.add_parser('evacuate', help='Evacuate rack')
     evacuate_command.add_argument("rack_name", help="Rack name")
+    evacuate_command.add_argument("--dry-run", action="store_true", help="Only show the planned moves")
     evacuate_command.set_defaults(func=evacuate_rack)
 
     remove_server_command = sub_parser.add_parser('remove', help="Remove machine")
     remove_server_command.add_argument("server_name", help="Machine name")
+    remove_server_command.add_argument("--dry-run", action="store_true", help="Only show the planned moves")
     remove_server_command.set_defaults(func=remove_machine)
 
+    init_db_command = sub_parser.add_parser('init-db', help="Create database indexes")
+    init_db_command.set_defaults(func=init_db)
+
+    simulate_command = sub_parser.add_parser('simulate', help="Replay a workload trace without changing anything")
+    simulate_command.add_argument("trace", help="Trace file, or - for standard input")
+    simulate_command.set_defaults(func=simulate)
+
+    stats_command = sub_parser.add_parser('stats', help="Show the calls counted for every DAO and Controller call")
+    stats_command.add_argument("--reset", action="store_true", help="Clear the counters after showing them")
+    add_format(stats_command)
+    stats_command.set_defaults(func=show_stats)
+
     add_server_command = sub_parser.add_parser('add', help="Add a new machine")
     add_server_command.add_argument("--mem", help="Memory of machine")
     add_server_command.add_argument("--disk", help="disk size of machine")
@@ -194,6 +376,12 @@ def main(argv):
     add_server_command.add_argument("server_name", help=" Machine name")
     add_server_command.set_defaults(func=add_machine)
 
+    run_command = sub_parser.add_parser('run', help="run the aggiestack commands of a script in this process")
+    run_command.add_argument("script", help="script of 'aggiestack ...' lines, or - for standard input")
+    run_command.add_argument("--stop-on-error", action="store_true", help="stop at the first failed command")
+    run_command.add_argument("--timing", action="store_true", help="print the outcome and time of every command")
+    run_command.set_defaults(func=run_script)
+
     server_command = sub_parser.add_parser('server', help='server command')
     sub_sub_parser = server_command.add_subparsers(help='create, list or delete')
     server_create_command = sub_sub_parser.add_parser('create', help='create server')
@@ -202,27 +390,90 @@ def main(argv):
     server_create_command.add_argument("instance_name", help="instance_name")
     server_create_command.set_defaults(func=create_server)
 
+    server_create_batch_command = sub_sub_parser.add_parser('create-batch', help='create many servers')
+    server_create_batch_command.add_argument("--file", help="file of 'INSTANCE_NAME IMAGE FLAVOR' lines, - for stdin")
+    server_create_batch_command.add_argument("--count", help="number of instances named PREFIX-1 .. PREFIX-N")
+    server_create_batch_command.add_argument("--image", help="image used with --count")
+    server_create_batch_command.add_argument("--flavor", help="flavor used with --count")
+    server_create_batch_command.add_argument("--workers", help="place the instances with N parallel workers")
+    server_create_batch_command.add_argument("prefix", nargs='?', default='instance', help="name prefix for --count")
+    server_create_batch_command.set_defaults(func=create_server_batch)
+
     server_list_command = sub_sub_parser.add_parser('list', help='list server')
+    add_paging(server_list_command)
+    add_format(server_list_command)
     server_list_command.set_defaults(func=display_server)
 
     server_delete_command = sub_sub_parser.add_parser('delete', help='delete server')
     server_delete_command.add_argument('instance_name', help="instance_name")
     server_delete_command.set_defaults(func=delete_server)
 
+    _parser = parser
+    return parser
+
+
+# Runs one command. argv holds the words after the program name. Returns True if the command succeeded
+def execute(argv):
+    parser = build_parser()
+    log.command_line = [sys.argv[0]] + list(argv)
+    log.last_error = None
     try:
-        if sys.argv[1] == 'admin':
+        if argv[0] == 'admin':
             privilege["admin_privilege"] = True
-            args = parser.parse_args(sys.argv[2:])
+            args = parser.parse_args(argv[1:])
         else:
             privilege["admin_privilege"] = False
-            args = parser.parse_args(sys.argv[1:])
-        args.func(args)
+            args = parser.parse_args(argv)
+        if args.profile or args.profile_out:
+            Instrumentation.install()
+            Display.display_stats(Instrumentation.profile(args.func, [args], args.profile_out))
+        else:
+            args.func(args)
+
+    except SystemExit:
+        return False
 
     except Exception as e:
 
         message = "Command cannot be executed "
         print(message)
         parser.print_usage()
+        return False
+
+    return log.last_error is None
+
+
+# Runs a command issued through the daemon, then saves what it changed
+def execute_in_daemon(argv):
+    try:
+        return execute(argv)
+    finally:
+        Controller.flush()
+
+
+# 'serve' keeps this process running and answers commands on the daemon socket. Any other command is forwarded to
+# a running daemon, or executed in this process when there is none. Calls are only counted by a daemon, when
+# AGGIESTACK_STATS keeps the counts, or for a command run with --profile
+def main(argv):
+    if Instrumentation.STATS_FILE is not None:
+        Instrumentation.install()
+    if len(argv) > 1 and argv[1] == 'serve':
+        Instrumentation.install()
+        Controller.check_tables()
+        try:
+            Daemon.serve(execute_in_daemon)
+        finally:
+            Controller.close_connection()
+        return
+
+    if Daemon.forward(argv[1:]):
+        return
+
+    Controller.check_tables()
+    try:
+        execute(argv[1:])
+    finally:
+        Controller.close_connection()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""Benchmark of placement, image caching and migration at data center scale. For every scale it writes synthetic
+hdwr-config, image-config and flavor-config files, loads them into an empty store with the config commands, then times
+    create    Controller.create_instance_with_cache, images drawn from a skewed popularity so racks hit and evict
+    lru       DAO.check_lru on random racks and images
+    remove    Controller.remove_server
+    evacuate  Controller.migrate_rack
+and reports operations per second, the median and 99th percentile latency and the database round trips per operation.
+Only the mongo backend counts round trips; with the memory backend that column shows n/a.
+
+    python benchmarks/PlacementBenchmark.py --servers 1000,10000,100000
+    python benchmarks/PlacementBenchmark.py --backend mongo --database Aggiestack_benchmark
+
+The mongo backend uses the server configured in DAO.py and drops the benchmark database before every scale. Never
+point it at the database of a running data center.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DAO as dao
+from Controller import Controller
+from Display import Display, FORMATS
+
+# Flavors of the generated flavor-config, (name, memory, disk, vcpu)
+FLAVORS = [("small", 1, 1, 1), ("medium", 8, 2, 4), ("large", 16, 2, 4), ("xlarge", 32, 4, 8)]
+
+# Machine shapes of the generated hdwr-config, (memory, disk, vcpu)
+MACHINES = [(64, 512, 16), (128, 1024, 32), (256, 2048, 64)]
+
+# Image sizes of the generated image-config
+IMAGE_SIZES = [128, 512, 2048, 8192]
+
+# Storage of every generated rack. Holds a few of the images, so placements also evict
+RACK_STORAGE = 40960
+
+REPORT_HEADERS = ["Servers", "Operation", "Ops", "Failures", "Ops_per_sec", "p50_ms", "p99_ms", "RoundTrips_per_op"]
+
+
+class PlacementBenchmark:
+
+    def __init__(self, servers, servers_per_rack, images, seed):
+        self.servers = servers
+        self.racks = max(servers // servers_per_rack, 2)
+        self.images = images
+        self.random = random.Random(seed)
+        self.instances = []
+
+    # Writes the three config files in the formats read by the config command
+    def write_configs(self, directory):
+        hardware = os.path.join(directory, "hdwr-config.txt")
+        with open(hardware, "w") as f:
+            f.write("{}\n".format(self.racks))
+            for r in range(self.racks):
+                f.write("r{} {}\n".format(r, RACK_STORAGE))
+            f.write("{}\n".format(self.servers))
+            for s in range(self.servers):
+                memory, disk, vcpu = self.random.choice(MACHINES)
+                f.write("m{} r{} 10.{}.{}.{} {} {} {}\n".format(s, s % self.racks, s // 65536 % 256, s // 256 % 256,
+                                                               s % 256, memory, disk, vcpu))
+        images = os.path.join(directory, "image-config.txt")
+        with open(images, "w") as f:
+            f.write("{}\n".format(self.images))
+            for i in range(self.images):
+                f.write("img{} {} /images/img{}.img\n".format(i, self.random.choice(IMAGE_SIZES), i))
+        flavors = os.path.join(directory, "flavor-config.txt")
+        with open(flavors, "w") as f:
+            f.write("{}\n".format(len(FLAVORS)))
+            for flavor in FLAVORS:
+                f.write("{} {} {} {}\n".format(*flavor))
+        return hardware, images, flavors
+
+    # Returns an image name, the first images being far more popular than the last ones
+    def image(self):
+        return "img{}".format(int(self.random.paretovariate(1.2)) % self.images)
+
+    def create(self, n):
+        name = "bench-{}".format(n)
+        Controller.create_instance_with_cache(name, self.random.choice(FLAVORS)[0], self.image())
+        self.instances.append(name)
+
+    def lru(self, n):
+        dao.check_lru("r{}".format(self.random.randrange(self.racks)), self.image())
+
+    def remove(self, n):
+        Controller.remove_server("m{}".format(self.random.randrange(self.servers)))
+
+    def evacuate(self, n):
+        Controller.migrate_rack("r{}".format(n % self.racks))
+
+
+# Runs operation(n) for n in range(count) and returns its report row. Failed operations are counted but not timed.
+# Round trips are only reported when the backend counts them
+def measure(servers, name, operation, count, round_trips_counted=True):
+    latencies = []
+    failures = 0
+    round_trips = dao.round_trips()
+    started = time.perf_counter()
+    for n in range(count):
+        op_started = time.perf_counter()
+        try:
+            operation(n)
+        except Exception:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - op_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    if not round_trips_counted:
+        round_trips_per_op = "n/a"
+    elif count:
+        round_trips_per_op = "{:.2f}".format(float(dao.round_trips() - round_trips) / count)
+    else:
+        round_trips_per_op = "-"
+    return {"Servers": servers, "Operation": name, "Ops": count, "Failures": failures,
+            "Ops_per_sec": int(count / elapsed) if elapsed else "-",
+            "p50_ms": percentile_ms(latencies, 0.50), "p99_ms": percentile_ms(latencies, 0.99),
+            "RoundTrips_per_op": round_trips_per_op}
+
+
+# Returns the q quantile of the sorted latencies in milliseconds
+def percentile_ms(latencies, q):
+    if not latencies:
+        return "-"
+    return "{:.3f}".format(latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))] * 1000)
+
+
+# Replaces the store with an empty one of the selected backend
+def new_backend(args):
+    if args.backend == "memory":
+        from storage.MemoryBackend import MemoryBackend
+        dao.use_backend(MemoryBackend())
+    else:
+        from storage.MongoBackend import MongoBackend
+        backend = MongoBackend(dao.MongoDB_Server_IP, dao.MongoDB_Server_Port, args.database)
+        backend.client().drop_database(args.database)
+        dao.use_backend(backend)
+    dao.initialize()
+
+
+def run(args):
+    report = []
+    counted = args.backend == "mongo"
+    for servers in [int(scale) for scale in args.servers.split(",")]:
+        benchmark = PlacementBenchmark(servers, args.servers_per_rack, args.images, args.seed)
+        new_backend(args)
+        with tempfile.TemporaryDirectory() as directory:
+            hardware, images, flavors = benchmark.write_configs(directory)
+            config = [lambda n: Controller.create_racks_servers(hardware),
+                      lambda n: Controller.create_images(images),
+                      lambda n: Controller.create_flavors(flavors)]
+            report.append(measure(servers, "config", lambda n: config[n](n), len(config), counted))
+        report.append(measure(servers, "create", benchmark.create, args.creates, counted))
+        report.append(measure(servers, "lru", benchmark.lru, args.lru, counted))
+        report.append(measure(servers, "remove", benchmark.remove, args.removes, counted))
+        report.append(measure(servers, "evacuate", benchmark.evacuate, args.evacuations, counted))
+        dao.close()
+    Display.write_rows(report, REPORT_HEADERS, args.format)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="PlacementBenchmark")
+    parser.add_argument("--servers", default="1000,10000", help="comma separated numbers of servers")
+    parser.add_argument("--servers-per-rack", type=int, default=50, help="servers in every rack")
+    parser.add_argument("--images", type=int, default=40, help="number of images")
+    parser.add_argument("--creates", type=int, default=2000, help="instances created at every scale")
+    parser.add_argument("--lru", type=int, default=2000, help="image cache updates at every scale")
+    parser.add_argument("--removes", type=int, default=20, help="machines removed at every scale")
+    parser.add_argument("--evacuations", type=int, default=3, help="racks evacuated at every scale")
+    parser.add_argument("--backend", choices=("memory", "mongo"), default="memory", help="store to benchmark")
+    parser.add_argument("--database", default="Aggiestack_benchmark", help="database dropped and used by mongo")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated configs and operations")
+    parser.add_argument("--format", choices=FORMATS, default="table", help="output format")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
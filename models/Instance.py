@@ -1,6 +1,8 @@
 class Instance:
-    def __init__(self, name, flavor, image, server):
+    def __init__(self, name, flavor, image, server, resources=None):
         self.Name = name
         self.Image = image
         self.Flavor = flavor
         self.Server = server
+        # [memory, disk, vcpu] of the flavor, so that deleting or moving the instance needs no flavor lookup
+        self.Resources = resources
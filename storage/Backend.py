@@ -0,0 +1,258 @@
+import logging
+from RackCache import RackCache
+import Exceptions as exp
+
+# Times check_lru recomputes the rack cache when another writer changed it first
+CACHE_UPDATE_RETRIES = 5
+
+# Logger of the command log (Logger.py). Used for failures that do not fail the command
+_log = logging.getLogger("aggiestack")
+
+# Fields the default find_best_fit reads from each server
+FIT_FIELDS = ["Name", "Rack", "Memory_free", "disk_free", "VCPU_free"]
+
+
+# Returns a new document with only the given fields of doc, or doc itself when fields is None. A field "A.B" keeps
+# field B of every document in the array A, like a Mongo projection
+def project(doc, fields):
+    if doc is None or fields is None:
+        return doc
+    result = dict()
+    for field in fields:
+        if "." in field:
+            array, key = field.split(".", 1)
+            if array in doc:
+                entries = result.setdefault(array, [dict() for entry in doc[array]])
+                for entry, source in zip(entries, doc[array]):
+                    if key in source:
+                        entry[key] = source[key]
+        elif field in doc:
+            result[field] = doc[field]
+    return result
+
+
+# Storage backend interface. DAO delegates every operation to the active backend, so Controller, Validator and
+# Display never talk to a concrete store. Documents are plain dictionaries keyed like the model attributes.
+class Backend:
+
+    # Creates the indexes or any other structure the backend needs before use
+    def initialize(self):
+        pass
+
+    # Returns the version of the database layout stored by set_schema_version, 0 if none was stored
+    def get_schema_version(self):
+        raise NotImplementedError
+
+    def set_schema_version(self, version):
+        raise NotImplementedError
+
+    # Makes the writes done so far durable
+    def flush(self):
+        pass
+
+    # Releases resources held by the backend
+    def close(self):
+        pass
+
+    # Returns the number of requests sent to the store so far. Stores kept in process make none
+    def round_trips(self):
+        return 0
+
+    def search_lookup(self, image):
+        raise NotImplementedError
+
+    def update_lookup(self, image, rack, flag=False):
+        raise NotImplementedError
+
+    def create_flavors(self, list_flavors):
+        raise NotImplementedError
+
+    # The read methods below take fields, to return only those fields of each document. The listing methods also take
+    # offset and limit, to return one page of the documents. A field "A.B" keeps field B of the documents in array A
+    def get_flavor(self, name, fields=None):
+        raise NotImplementedError
+
+    def get_all_flavors(self, fields=None, offset=0, limit=None):
+        raise NotImplementedError
+
+    def create_images(self, list_images):
+        raise NotImplementedError
+
+    def get_image(self, name, fields=None):
+        raise NotImplementedError
+
+    def get_all_images(self, fields=None, offset=0, limit=None):
+        raise NotImplementedError
+
+    def create_racks(self, list_racks):
+        raise NotImplementedError
+
+    def get_rack(self, r, fields=None):
+        raise NotImplementedError
+
+    def get_all_racks(self, fields=None):
+        raise NotImplementedError
+
+    def get_valid_racks(self):
+        raise NotImplementedError
+
+    # Sets the cache fields of the rack (see RackCache.FIELDS) and increments its CacheVersion, only if the
+    # CacheVersion is still version. Returns True if the rack was updated
+    def replace_rack_cache(self, r, version, fields):
+        raise NotImplementedError
+
+    # Selects the eviction policy of the rack. The policy state starts empty
+    def set_rack_cache_policy(self, r, policy):
+        raise NotImplementedError
+
+    # Adds and removes (image, rack) pairs of the ImageLookup table
+    def update_lookups(self, added=(), removed=()):
+        for image, rack in added:
+            self.update_lookup(image, rack)
+        for image, rack in removed:
+            self.update_lookup(image, rack, True)
+
+    def create_server(self, server):
+        raise NotImplementedError
+
+    def create_servers(self, list_servers):
+        raise NotImplementedError
+
+    def delete_server(self, server_name):
+        raise NotImplementedError
+
+    def deactivate_server(self, server_name):
+        raise NotImplementedError
+
+    def reactivate_server(self, server_name):
+        raise NotImplementedError
+
+    def get_all_servers(self, racks=None, fields=None):
+        raise NotImplementedError
+
+    def get_all_valid_server(self, fields=None, offset=0, limit=None):
+        raise NotImplementedError
+
+    def get_all_servers_except(self, racks):
+        raise NotImplementedError
+
+    def get_server(self, name, fields=None):
+        raise NotImplementedError
+
+    # Returns the active server with the least free memory, disk and vcpu that can host the flavor document, or
+    # None. The search can be limited to racks, and racks in exclude_racks are skipped
+    def find_best_fit(self, flavor, racks=None, exclude_racks=None, fields=None):
+        for server in self.get_all_servers(racks, None if fields is None else FIT_FIELDS + list(fields)):
+            if exclude_racks is not None and server["Rack"] in exclude_racks:
+                continue
+            if server["Memory_free"] >= flavor["Memory"] and \
+                    server["disk_free"] >= flavor["Disk"] and \
+                    server["VCPU_free"] >= flavor["VCPU"]:
+                return project(server, fields)
+        return None
+
+    # Takes the resources of the flavor from the server (flag True) or gives them back
+    def update_server(self, server_name, flavor, flag):
+        self.update_free_capacity(server_name, self.flavor_resources(flavor), -1 if flag else 1)
+
+    # Adds sign times the [memory, disk, vcpu] resources to the free capacity of the server
+    def update_free_capacity(self, server_name, resources, sign):
+        raise NotImplementedError
+
+    # Takes the [memory, disk, vcpu] resources from the server in one step, only if it is active and has them all
+    # free. Returns the server name and rack, or None if it does not
+    def reserve_capacity(self, server_name, resources):
+        raise NotImplementedError
+
+    # Returns the [memory, disk, vcpu] the flavor needs
+    def flavor_resources(self, flavor):
+        flavor = self.get_flavor(flavor, ["Memory", "Disk", "VCPU"])
+        return [flavor["Memory"], flavor["Disk"], flavor["VCPU"]]
+
+    # Returns the [memory, disk, vcpu] of the instance document: the resources stamped on it when it was created, or
+    # those of its flavor for instances stored before the stamp existed
+    def instance_resources(self, instance):
+        resources = instance.get("Resources")
+        return resources if resources is not None else self.flavor_resources(instance["Flavor"])
+
+    # Returns True if a document with the given name exists in the collection
+    def name_exists(self, collection, name):
+        raise NotImplementedError
+
+    # Returns the subset of names that belong to existing instances
+    def get_existing_instance_names(self, names):
+        raise NotImplementedError
+
+    # Returns True if an instance with the given name exists
+    def instance_exists(self, name):
+        return self.name_exists("Instances", name)
+
+    # Stores the instance document as is. Returns False, storing nothing, if an instance with the same name exists
+    def insert_instance(self, instance):
+        raise NotImplementedError
+
+    def delete_instance(self, name):
+        raise NotImplementedError
+
+    def get_all_instances(self, server=None, fields=None, offset=0, limit=None):
+        raise NotImplementedError
+
+    # Stores every write of a Planner.Plan
+    def apply_plan(self, plan):
+        raise NotImplementedError
+
+    # Return valid flavors
+    def get_valid_flavors(self):
+        return [flavor["Name"] for flavor in self.get_all_flavors(["Name"])]
+
+    # Returns valid images
+    def get_valid_images(self):
+        return [image["Name"] for image in self.get_all_images(["Name"])]
+
+    # Return the servers currently present in the database
+    def get_valid_server(self):
+        return [server["Name"] for server in self.get_all_valid_server(["Name"])]
+
+    # Returns list of instance present in database. Used for validation
+    def get_all_instances_name(self):
+        return [instance["Name"] for instance in self.get_all_instances(None, ["Name"])]
+
+    # Creates instance if instance with same name doesnot exists. The resources are reserved on the server first, so
+    # concurrent commands never overcommit it; the unique name is enforced by the insert itself. Returns False,
+    # changing nothing, if the server no longer has the resources. The reservation is given back when the insert
+    # fails. Once the instance exists a failed image cache update is logged, not raised
+    def create_instance(self, new_instance):
+        if new_instance.Resources is None:
+            new_instance.Resources = self.flavor_resources(new_instance.Flavor)
+        server = self.reserve_capacity(new_instance.Server, new_instance.Resources)
+        if server is None:
+            return False
+        try:
+            inserted = self.insert_instance(new_instance.__dict__)
+        except Exception:
+            self.update_free_capacity(new_instance.Server, new_instance.Resources, 1)
+            raise
+        if not inserted:
+            self.update_free_capacity(new_instance.Server, new_instance.Resources, 1)
+            raise Exception(exp.INSTANCE_ALREADY_EXISTS.format(new_instance.Name))
+        try:
+            self.check_lru(server["Rack"], new_instance.Image)
+        except Exception as e:
+            error = exp.RACK_CACHE_NOT_UPDATED.format(new_instance.Name, server["Rack"], e)
+            _log.warning(error, extra={"audit": {"outcome": "warning", "error": error}})
+        return True
+
+    # Caches the image in the rack, evicting images chosen by the rack eviction policy (Least Recently used by
+    # default). The evictions and the insertion are computed in memory and stored with one update of the rack, guarded
+    # by its CacheVersion. If another command changed the cache in between, the rack is read again and the update
+    # retried
+    def check_lru(self, r, img):
+        image = self.get_image(img, RackCache.ENTRY_FIELDS)
+        for attempt in range(CACHE_UPDATE_RETRIES):
+            rack = self.get_rack(r, RackCache.READ_FIELDS)
+            version = rack.get("CacheVersion", 0)
+            evicted, added = RackCache.admit(rack, image, RackCache.next_timestamp())
+            if self.replace_rack_cache(r, version, RackCache.fields(rack)):
+                self.update_lookups([(img, r)] if added else [], [(victim, r) for victim in evicted])
+                return
+        raise Exception(exp.RACK_CACHE_CONFLICT.format(r))
@@ -0,0 +1,403 @@
+import copy
+import functools
+import itertools
+import os
+import pickle
+import threading
+from storage.Backend import Backend, project
+from PlacementIndex import PlacementIndex
+from RackCache import RackCache
+import Exceptions as exp
+
+SORT_KEY = ("Memory_free", "disk_free", "VCPU_free")
+
+
+# Returns a copy of the document so callers can modify it without touching the stored one, same as a Mongo read
+def _clone(doc):
+    if doc is None:
+        return None
+    result = dict(doc)
+    if "ImageCache" in result:
+        result["ImageCache"] = [dict(image) for image in result["ImageCache"]]
+    for key in ("CacheState", "CacheStats"):
+        if key in result:
+            result[key] = copy.deepcopy(result[key])
+    if "Racks" in result:
+        result["Racks"] = list(result["Racks"])
+    return result
+
+
+# Returns a copy of the document, or of only the given fields of it
+def _read(doc, fields=None):
+    return _clone(project(doc, fields))
+
+
+# Returns the documents from offset on, at most limit of them, as an iterator of copies holding only the given fields
+# when fields is set. Only references to the page are taken up front, and each copy is made when it is read
+def _select(documents, fields=None, offset=0, limit=None):
+    page = list(itertools.islice(documents, offset, None if limit is None else offset + limit))
+    return (_read(doc, fields) for doc in page)
+
+
+# Orders servers in increasing order of available memory, disk and vcpu
+def _capacity_key(server):
+    return tuple(server[key] for key in SORT_KEY)
+
+
+# Runs the method holding the backend lock. Placement reads and writes made by several threads (Scheduler workers)
+# then each see and leave the collections whole
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Pure Python storage engine. Every collection is a dictionary keyed by name, with secondary indexes from rack to
+# servers and from server to instances (dictionaries used as ordered sets). When a snapshot path is given the state
+# is loaded from it on start and written back on close, so consecutive commands see each other's writes without a
+# database daemon. Active servers are also kept in a placement index so best fit queries never scan the fleet.
+class MemoryBackend(Backend):
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self._flavors = dict()
+        self._images = dict()
+        self._racks = dict()
+        self._servers = dict()
+        self._instances = dict()
+        self._lookup = dict()
+        self._servers_by_rack = dict()
+        self._instances_by_server = dict()
+        self._placement = PlacementIndex()
+        self._next_id = 0
+        self._schema_version = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    # Loads the collections from a snapshot file and rebuilds the secondary indexes
+    def load(self, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        self._flavors = state["Flavors"]
+        self._images = state["Images"]
+        self._racks = state["Racks"]
+        self._servers = state["Servers"]
+        self._instances = state["Instances"]
+        self._lookup = state["ImageLookup"]
+        self._next_id = state["NextId"]
+        self._schema_version = state.get("SchemaVersion", 0)
+        self._servers_by_rack = dict()
+        self._placement = PlacementIndex(self._servers.values())
+        for server in self._servers.values():
+            self._servers_by_rack.setdefault(server["Rack"], dict())[server["Name"]] = None
+        self._instances_by_server = dict()
+        for instance in self._instances.values():
+            self._instances_by_server.setdefault(instance["Server"], dict())[instance["Name"]] = None
+
+    # Writes the collections to a snapshot file. The file is replaced atomically so a crash never leaves half a file
+    @_locked
+    def save(self, path):
+        state = {"Flavors": self._flavors, "Images": self._images, "Racks": self._racks,
+                 "Servers": self._servers, "Instances": self._instances, "ImageLookup": self._lookup,
+                 "NextId": self._next_id, "SchemaVersion": self._schema_version}
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self._dirty = False
+
+    # Writes the snapshot if anything changed since it was loaded or last saved
+    def flush(self):
+        if self.snapshot_path is not None and self._dirty:
+            self.save(self.snapshot_path)
+
+    def close(self):
+        self.flush()
+
+    def get_schema_version(self):
+        return self._schema_version
+
+    def set_schema_version(self, version):
+        self._dirty = True
+        self._schema_version = version
+
+    # Stamps a new document with an id, the same way Mongo does on insert
+    def _new_document(self, fields):
+        self._next_id += 1
+        doc = dict(fields)
+        doc["_id"] = self._next_id
+        return doc
+
+    # Inserts the document or sets its fields if a document with the same name exists
+    def _upsert(self, collection, fields):
+        self._dirty = True
+        existing = collection.get(fields["Name"])
+        if existing is None:
+            collection[fields["Name"]] = self._new_document(_clone(fields))
+        else:
+            existing.update(_clone(fields))
+        return collection[fields["Name"]]
+
+    # Searches the Racks for cached copy of the request image. Returns None if cannot find any
+    @_locked
+    def search_lookup(self, image):
+        racks = self._lookup.get(image)
+        return list(racks) if racks is not None else None
+
+    # Updates the Rack-Image-Cache table every time new image is added or old image is removed from the Racks
+    @_locked
+    def update_lookup(self, image, rack, flag=False):
+        self._dirty = True
+        racks = self._lookup.get(image)
+        if racks is not None:
+            if flag:
+                if rack in racks:
+                    racks.remove(rack)
+            elif rack not in racks:
+                racks.append(rack)
+        elif not flag:
+            self._lookup[image] = [rack]
+
+    # Creates Flavors from flavor configuration file
+    def create_flavors(self, list_flavors):
+        for flavor in list_flavors:
+            self._upsert(self._flavors, flavor.__dict__)
+
+    # Returns the flavor present in database else returns None
+    def get_flavor(self, name, fields=None):
+        return _read(self._flavors.get(name), fields)
+
+    # Returns all the flavors in the database
+    def get_all_flavors(self, fields=None, offset=0, limit=None):
+        return _select(self._flavors.values(), fields, offset, limit)
+
+    # Creates images that are read from image configuration file
+    def create_images(self, list_images):
+        for image in list_images:
+            self._upsert(self._images, image.__dict__)
+
+    # Returns the images present in database else returns None
+    def get_image(self, name, fields=None):
+        return _read(self._images.get(name), fields)
+
+    # Returns all the images in database
+    def get_all_images(self, fields=None, offset=0, limit=None):
+        return _select(self._images.values(), fields, offset, limit)
+
+    # Creates Racks from configuration file. Racks already present keep their image cache
+    def create_racks(self, list_racks):
+        for rack in list_racks:
+            if rack.Name not in self._racks:
+                self._upsert(self._racks, rack.__dict__)
+
+    # Returns the rack requested
+    @_locked
+    def get_rack(self, r, fields=None):
+        return _read(self._racks.get(r), fields)
+
+    # Returns all the racks in database
+    def get_all_racks(self, fields=None):
+        return list(_select(self._racks.values(), fields))
+
+    # Returns the list of rack currently present in the database
+    def get_valid_racks(self):
+        return list(self._racks.keys())
+
+    # Stores the computed cache if the rack still has the expected CacheVersion
+    @_locked
+    def replace_rack_cache(self, r, version, fields):
+        rack = self._racks.get(r)
+        if rack is None or rack.get("CacheVersion", 0) != version:
+            return False
+        self._dirty = True
+        rack.update(copy.deepcopy(fields))
+        rack["CacheVersion"] = version + 1
+        return True
+
+    # Selects the eviction policy of the rack and clears the state of the previous one
+    def set_rack_cache_policy(self, r, policy):
+        rack = self._racks.get(r)
+        if rack is not None:
+            self._dirty = True
+            rack["CachePolicy"] = policy
+            rack["CacheState"] = dict()
+            rack["CacheVersion"] = rack.get("CacheVersion", 0) + 1
+
+    # Creates individual Machine if non existing, Updates if deactivated. Used during add machine operation.
+    def create_server(self, server):
+        existing = self._servers.get(server.Name)
+        if existing is not None and existing["isActive"]:
+            print("Machine \"{}\" already exists".format(server.Name))
+            return
+        if existing is not None:
+            self._servers_by_rack[existing["Rack"]].pop(server.Name, None)
+        self._placement.update(self._upsert(self._servers, server.__dict__))
+        self._servers_by_rack.setdefault(server.Rack, dict())[server.Name] = None
+
+    # Creates multiple machine at once. Machines already present are left as they are, like the Mongo upserts
+    def create_servers(self, list_servers):
+        for server in list_servers:
+            if server.Name in self._servers:
+                continue
+            self._placement.update(self._upsert(self._servers, server.__dict__))
+            self._servers_by_rack.setdefault(server.Rack, dict())[server.Name] = None
+
+    # Deletes the machine from database
+    def delete_server(self, server_name):
+        server = self._servers.pop(server_name, None)
+        if server is not None:
+            self._dirty = True
+            self._servers_by_rack[server["Rack"]].pop(server_name, None)
+            self._placement.remove(server_name)
+
+    # Deactivates the active state of machine
+    def deactivate_server(self, server_name):
+        self._set_active(server_name, False)
+
+    # Reactivates the server state of machine
+    def reactivate_server(self, server_name):
+        self._set_active(server_name, True)
+
+    def _set_active(self, server_name, active):
+        server = self._servers.get(server_name)
+        if server is not None:
+            self._dirty = True
+            server["isActive"] = active
+            self._placement.update(server)
+
+    # Returns all the active servers in increasing order of available memory, disk and vcpu
+    def get_all_servers(self, racks=None, fields=None):
+        if racks is not None:
+            names = dict()
+            for rack in racks:
+                names.update(self._servers_by_rack.get(rack, {}))
+            candidates = [self._servers[name] for name in names]
+        else:
+            candidates = self._servers.values()
+        result = sorted((server for server in candidates if server["isActive"]), key=_capacity_key)
+        return [_read(server, fields) for server in result]
+
+    # Returns all the servers present in database irrespective of their active status
+    def get_all_valid_server(self, fields=None, offset=0, limit=None):
+        return _select(sorted(self._servers.values(), key=_capacity_key), fields, offset, limit)
+
+    # Returns all active servers not present in racks
+    def get_all_servers_except(self, racks):
+        return [_clone(server) for server in self._servers.values()
+                if server["isActive"] and server["Rack"] not in racks]
+
+    # Return the server by name
+    @_locked
+    def get_server(self, name, fields=None):
+        return _read(self._servers.get(name), fields)
+
+    # Answers from the placement index instead of sorting the active servers
+    @_locked
+    def find_best_fit(self, flavor, racks=None, exclude_racks=None, fields=None):
+        name = self._placement.best_fit(flavor["Memory"], flavor["Disk"], flavor["VCPU"], racks, exclude_racks)
+        return _read(self._servers[name], fields) if name is not None else None
+
+    # Adds sign times the [memory, disk, vcpu] resources to the free capacity of the server
+    @_locked
+    def update_free_capacity(self, server_name, resources, sign):
+        server = self._servers.get(server_name)
+        if server is None:
+            return
+        self._dirty = True
+        server["Memory_free"] += sign * resources[0]
+        server["disk_free"] += sign * resources[1]
+        server["VCPU_free"] += sign * resources[2]
+        self._placement.update(server)
+
+    # Takes the resources only if the server is active and has them all free, checked and changed under the lock
+    @_locked
+    def reserve_capacity(self, server_name, resources):
+        server = self._servers.get(server_name)
+        if server is None or not server["isActive"] or server["Memory_free"] < resources[0] or \
+                server["disk_free"] < resources[1] or server["VCPU_free"] < resources[2]:
+            return None
+        self.update_free_capacity(server_name, resources, -1)
+        return _read(server, ["Name", "Rack"])
+
+    # Returns True if a document with the given name exists in the collection
+    @_locked
+    def name_exists(self, collection, name):
+        return name in self._collections()[collection]
+
+    # Returns the subset of names that belong to existing instances
+    def get_existing_instance_names(self, names):
+        return [name for name in names if name in self._instances]
+
+    def _collections(self):
+        return {"Flavors": self._flavors, "Images": self._images, "Racks": self._racks,
+                "Servers": self._servers, "Instances": self._instances}
+
+    # Stores the instance document. Returns False if an instance with the same name exists
+    @_locked
+    def insert_instance(self, instance):
+        if instance["Name"] in self._instances:
+            return False
+        self._dirty = True
+        doc = self._new_document(instance)
+        instance["_id"] = doc["_id"]
+        self._instances[doc["Name"]] = doc
+        self._instances_by_server.setdefault(doc["Server"], dict())[doc["Name"]] = None
+        return True
+
+    # Delete instance from database
+    @_locked
+    def delete_instance(self, name):
+        instance = self._instances.pop(name, None)
+        if instance is not None:
+            self._dirty = True
+            self._instances_by_server[instance["Server"]].pop(name, None)
+            self.update_free_capacity(instance["Server"], self.instance_resources(instance), 1)
+
+    # Returns the list of all instance present in server. By default returns all instances in datacenter
+    def get_all_instances(self, server=None, fields=None, offset=0, limit=None):
+        if server is not None:
+            names = []
+            for server_name in server:
+                names.extend(self._instances_by_server.get(server_name, ()))
+            return _select([self._instances[name] for name in names], fields, offset, limit)
+        return _select(self._instances.values(), fields, offset, limit)
+
+    # Stores a Planner.Plan. Nothing is written if an instance of the plan already exists, or a server that loses
+    # capacity is no longer active or no longer has it free
+    @_locked
+    def apply_plan(self, plan):
+        for instance in plan.instances:
+            if instance["Name"] in self._instances:
+                raise Exception(exp.INSTANCE_ALREADY_EXISTS.format(instance["Name"]))
+        for name, delta in plan.server_deltas.items():
+            server = self._servers.get(name)
+            if server is None or min(delta) < 0 and not server["isActive"] or \
+                    any(server[field] + change < 0 for field, change in zip(SORT_KEY, delta) if change < 0):
+                raise Exception(exp.SERVER_CAPACITY_CONFLICT)
+        for instance in plan.instances:
+            self.insert_instance(instance)
+        for name, server in plan.moves.items():
+            instance = self._instances[name]
+            self._instances_by_server[instance["Server"]].pop(name, None)
+            instance["Server"] = server
+            self._instances_by_server.setdefault(server, dict())[name] = None
+        for name in plan.deactivated:
+            self._set_active(name, False)
+        for name, delta in plan.server_deltas.items():
+            server = self._servers[name]
+            server["Memory_free"] += delta[0]
+            server["disk_free"] += delta[1]
+            server["VCPU_free"] += delta[2]
+            self._placement.update(server)
+        for name in plan.deleted:
+            self.delete_server(name)
+        for name, rack in plan.racks.items():
+            stored = self._racks[name]
+            stored.update(copy.deepcopy(RackCache.fields(rack)))
+            stored["CacheVersion"] = stored.get("CacheVersion", 0) + 1
+        self.update_lookups(plan.lookup_added, plan.lookup_removed)
+        self._dirty = True
@@ -0,0 +1,504 @@
+from pymongo import MongoClient, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure
+import threading
+from storage.Backend import Backend
+from RackCache import RackCache
+from Catalog import Catalog
+import Exceptions as exp
+
+
+# Error code of a transaction started on a stand-alone server
+ILLEGAL_OPERATION = 20
+
+
+# Returns the find projection that keeps only the fields, or None to keep the whole documents
+def _projection(fields):
+    if fields is None:
+        return None
+    projection = dict((field, 1) for field in fields)
+    projection["_id"] = 0
+    return projection
+
+
+# Limits the cursor to the page starting at offset with at most limit documents
+def _page(cursor, offset=0, limit=None):
+    if offset:
+        cursor = cursor.skip(offset)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+# Upserts the model objects by name in one unordered bulk write. With '$set' the documents present are overwritten,
+# with '$setOnInsert' they are left as they are
+def _upsert_all(collection, models, operator):
+    requests = [UpdateOne({"Name": model.Name}, {operator: model.__dict__}, upsert=True) for model in models]
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+
+
+# Returns the filter matching the rack only while its cache is still at the version read. Racks written before cache
+# versions existed have none
+def _cache_version_query(r, version):
+    return {"Name": r, "CacheVersion": version if version else {"$in": [0, None]}}
+
+
+# Returns the filter of the server whose free capacity changes by delta, [memory, disk, vcpu]. A server that loses
+# capacity must still be active and have it free, as in reserve_capacity
+def _capacity_query(name, delta):
+    query = {"Name": name}
+    if min(delta) < 0:
+        query["isActive"] = True
+        for field, change in zip(("Memory_free", "disk_free", "VCPU_free"), delta):
+            if change < 0:
+                query[field] = {"$gte": -change}
+    return query
+
+
+# Returns the $inc adding sign times delta to the free capacity
+def _capacity_change(delta, sign):
+    return {"Memory_free": sign * delta[0], "disk_free": sign * delta[1], "VCPU_free": sign * delta[2]}
+
+
+# Counts the commands the client sends to the server, one per round trip. Commands may be sent by several threads
+class _CommandCounter(monitoring.CommandListener):
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# MongoDB backend. Holds one pooled client for the life of the backend.
+class MongoBackend(Backend):
+
+    def __init__(self, host, port, database, max_pool_size=10, min_pool_size=0, connect_timeout=5000,
+                 socket_timeout=30000, server_selection_timeout=5000):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.connect_timeout = connect_timeout
+        self.socket_timeout = socket_timeout
+        self.server_selection_timeout = server_selection_timeout
+        self._client = None
+        self._commands = _CommandCounter()
+        self._catalog = Catalog(self._read_catalog)
+
+    # Returns the shared client, creating it on first use. Handshake and pool setup happen once per process
+    def client(self):
+        if self._client is None:
+            self._client = MongoClient(self.host, self.port,
+                                       maxPoolSize=self.max_pool_size,
+                                       minPoolSize=self.min_pool_size,
+                                       connectTimeoutMS=self.connect_timeout,
+                                       socketTimeoutMS=self.socket_timeout,
+                                       serverSelectionTimeoutMS=self.server_selection_timeout,
+                                       event_listeners=[self._commands])
+        return self._client
+
+    # Returns the database handle on the shared client
+    def connection(self):
+        return self.client()[self.database]
+
+    # Closes the shared client. The next call to connection() opens a new one
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    # Reads all the documents of a catalog collection
+    def _read_catalog(self, collection):
+        db = self.connection()
+        return db[collection].find({}, {"_id": 0})
+
+    # Returns the number of commands sent to the server by this backend
+    def round_trips(self):
+        return self._commands.count
+
+    # Initializes the database and creates necessary collection each with 'Name' as primary key
+    def initialize(self):
+        db = self.connection()
+        db["Racks"].create_index("Name", unique=True)
+        db["Servers"].create_index("Name", unique=True)
+        db["Flavors"].create_index("Name", unique=True)
+        db["Images"].create_index("Name", unique=True)
+        db["Instances"].create_index("Name", unique=True)
+        db["ImageLookup"].create_index("Image", unique=True)
+        db["Servers"].create_index([("isActive", 1), ("Rack", 1), ("Memory_free", 1), ("disk_free", 1),
+                                    ("VCPU_free", 1)])
+
+    # Reads the layout version from the single document of the 'Schema' collection
+    def get_schema_version(self):
+        db = self.connection()
+        schema = db["Schema"].find_one({"_id": "aggiestack"})
+        return schema["Version"] if schema is not None else 0
+
+    def set_schema_version(self, version):
+        db = self.connection()
+        db["Schema"].update_one({"_id": "aggiestack"}, {"$set": {"Version": version}}, upsert=True)
+
+    # This is a used for Part-C. Searches the Racks for cached copy of the request image. Returns None if cannot
+    # find any
+    def search_lookup(self, image):
+        db = self.connection()
+        lookup = db["ImageLookup"]
+        result = lookup.find_one({'Image': image})
+        if result is not None:
+            return result["Racks"]
+        else:
+            return result
+
+    # Updates the Rack-Image-Cache table every time new image is added or old image is removed from the Racks
+    def update_lookup(self, image, rack, flag=False):
+        db = self.connection()
+        lookup = db["ImageLookup"]
+        if lookup.find({'Image': image}).count() > 0:
+            if flag:
+                lookup.update({"Image": image}, {"$pull": {"Racks": rack}})
+            else:
+                lookup.update({"Image": image}, {"$addToSet": {"Racks": rack}})
+        else:
+            if not flag:
+                cache = dict()
+                cache["Image"] = image
+                cache["Racks"] = [rack]
+                lookup.insert_one(cache)
+
+    # Creates Flavors from flavor configuration file, or updates the flavors already present. Uses one unordered bulk
+    # write, so one failed document does not stop the others
+    def create_flavors(self, list_flavors):
+        db = self.connection()
+        flavors = db["Flavors"]
+        _upsert_all(flavors, list_flavors, "$set")
+        self._catalog.invalidate("Flavors")
+
+    # Returns the flavor present in database else returns None. Answered from the catalog
+    def get_flavor(self, name, fields=None):
+        return self._catalog.get("Flavors", name, fields)
+
+    # Returns all the flavors in the database. Answered from the catalog
+    def get_all_flavors(self, fields=None, offset=0, limit=None):
+        return self._catalog.select("Flavors", fields, offset, limit)
+
+    # Creates images that are read from image configuration file, or updates the images already present. Uses one
+    # unordered bulk write
+    def create_images(self, list_images):
+        db = self.connection()
+        images = db["Images"]
+        _upsert_all(images, list_images, "$set")
+        self._catalog.invalidate("Images")
+
+    # Returns the images present in database else returns None. Answered from the catalog
+    def get_image(self, name, fields=None):
+        return self._catalog.get("Images", name, fields)
+
+    # Returns all the images in database. Answered from the catalog
+    def get_all_images(self, fields=None, offset=0, limit=None):
+        return self._catalog.select("Images", fields, offset, limit)
+
+    # Creates Racks from configuration file. Racks already present keep their image cache, so loading the same file
+    # again changes nothing
+    def create_racks(self, list_racks):
+        db = self.connection()
+        racks = db["Racks"]
+        _upsert_all(racks, list_racks, "$setOnInsert")
+
+    # Returns the rack requested
+    def get_rack(self, r, fields=None):
+        db = self.connection()
+        racks = db["Racks"]
+        rack = racks.find_one({"Name": r}, _projection(fields))
+        return rack
+
+    # Returns all the racks in database
+    def get_all_racks(self, fields=None):
+        db = self.connection()
+        racks = db["Racks"]
+        result = racks.find({}, _projection(fields))
+        return result
+
+    # Returns the list of rack currently present in the database
+    def get_valid_racks(self):
+        db = self.connection()
+        racks = db["Racks"]
+        result = racks.find({}, _projection(["Name"]))
+        valid_racks = []
+        for rack in result:
+            valid_racks.append(rack["Name"])
+        return valid_racks
+
+    # Stores the computed cache with one update, matched only while the rack still has the expected CacheVersion
+    def replace_rack_cache(self, r, version, fields):
+        db = self.connection()
+        racks = db["Racks"]
+        result = racks.update_one(_cache_version_query(r, version), {"$set": fields, "$inc": {"CacheVersion": 1}})
+        return result.matched_count == 1
+
+    # Selects the eviction policy of the rack and clears the state of the previous one
+    def set_rack_cache_policy(self, r, policy):
+        db = self.connection()
+        racks = db["Racks"]
+        racks.update_one({"Name": r}, {"$set": {"CachePolicy": policy, "CacheState": {}},
+                                       "$inc": {"CacheVersion": 1}})
+
+    # Adds and removes (image, rack) pairs of the ImageLookup table with one unordered bulk write
+    def update_lookups(self, added=(), removed=(), session=None):
+        requests = [UpdateOne({"Image": image}, {"$addToSet": {"Racks": rack}}, upsert=True)
+                    for image, rack in added]
+        requests.extend(UpdateOne({"Image": image}, {"$pull": {"Racks": rack}}) for image, rack in removed)
+        if requests:
+            db = self.connection()
+            db["ImageLookup"].bulk_write(requests, ordered=False, session=session)
+
+    # Creates individual Machine if non existing, Updates if deactivated. Used during add machine operation.
+    def create_server(self, server):
+        db = self.connection()
+        servers = db["Servers"]
+        if servers.find({"Name": server.Name, "isActive": True}).count() > 0:
+            print("Machine \"{}\" already exists".format(server.Name))
+            return
+        servers.update_one({'Name': server.Name}, {"$set": server.__dict__}, upsert=True)
+
+    # Creates multiple machine at once. Used during config hardware operation. Machines already present are left as
+    # they are, so loading the same file again changes nothing
+    def create_servers(self, list_servers):
+        db = self.connection()
+        servers = db["Servers"]
+        _upsert_all(servers, list_servers, "$setOnInsert")
+
+    # Deletes the machine from database
+    def delete_server(self, server_name):
+        db = self.connection()
+        servers = db["Servers"]
+        server = servers.find_one({"Name": server_name})
+        if server is not None:
+            servers.remove(server)
+
+    # Deactivates the active state of machine
+    def deactivate_server(self, server_name):
+        db = self.connection()
+        servers = db["Servers"]
+        servers.update({"Name": server_name}, {"$set": {"isActive": False}})
+
+    # Reactivates the server state of machine
+    def reactivate_server(self, server_name):
+        db = self.connection()
+        servers = db["Servers"]
+        servers.update({"Name": server_name}, {"$set": {"isActive": True}})
+
+    # Returns all the servers created in increasing order of available memory, disk and vcpu
+    def get_all_servers(self, racks=None, fields=None):
+        db = self.connection()
+        servers = db["Servers"]
+        if racks is not None:
+            result = servers.find({"Rack": {"$in": racks}, "isActive": True}, _projection(fields))\
+                .sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
+        else:
+            result = servers.find({"isActive": True}, _projection(fields))\
+                .sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
+
+        return result
+
+    # Returns all the servers present in database irrespective of their active status
+    def get_all_valid_server(self, fields=None, offset=0, limit=None):
+        db = self.connection()
+        servers = db["Servers"]
+        result = servers.find({}, _projection(fields)).sort([("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
+        return _page(result, offset, limit)
+
+    # Returns all servers not present in racks
+    def get_all_servers_except(self, racks):
+        db = self.connection()
+        servers = db["Servers"]
+        all_servers = servers.find({"Rack": {"$nin": racks}, "isActive": True})
+        return all_servers
+
+    # Return the server by name
+    def get_server(self, name, fields=None):
+        db = self.connection()
+        servers = db["Servers"]
+        result = servers.find_one({"Name": name}, _projection(fields))
+        return result
+
+    # Runs the fit predicate inside the query so only the best fit document comes back. Uses the compound index on
+    # (isActive, Rack, Memory_free, disk_free, VCPU_free)
+    def find_best_fit(self, flavor, racks=None, exclude_racks=None, fields=None):
+        db = self.connection()
+        servers = db["Servers"]
+        query = {"isActive": True,
+                 "Memory_free": {"$gte": flavor["Memory"]},
+                 "disk_free": {"$gte": flavor["Disk"]},
+                 "VCPU_free": {"$gte": flavor["VCPU"]}}
+        if racks is not None or exclude_racks is not None:
+            query["Rack"] = dict()
+            if racks is not None:
+                query["Rack"]["$in"] = list(racks)
+            if exclude_racks is not None:
+                query["Rack"]["$nin"] = list(exclude_racks)
+        return servers.find_one(query, _projection(fields),
+                                sort=[("Memory_free", 1), ("disk_free", 1), ("VCPU_free", 1)])
+
+    # Adds sign times the [memory, disk, vcpu] resources to the free capacity of the server
+    def update_free_capacity(self, server_name, resources, sign):
+        db = self.connection()
+        servers = db["Servers"]
+        servers.update_one({"Name": server_name}, {"$inc": {"Memory_free": sign * resources[0],
+                                                            "disk_free": sign * resources[1],
+                                                            "VCPU_free": sign * resources[2]}})
+
+    # Takes the resources with a single update that only matches while the server is active and has them free, so
+    # two commands can never both take the last of them
+    def reserve_capacity(self, server_name, resources):
+        db = self.connection()
+        servers = db["Servers"]
+        return servers.find_one_and_update({"Name": server_name, "isActive": True,
+                                            "Memory_free": {"$gte": resources[0]},
+                                            "disk_free": {"$gte": resources[1]},
+                                            "VCPU_free": {"$gte": resources[2]}},
+                                           {"$inc": {"Memory_free": -resources[0],
+                                                     "disk_free": -resources[1],
+                                                     "VCPU_free": -resources[2]}},
+                                           projection={"_id": 0, "Name": 1, "Rack": 1})
+
+    # Returns True if a document with the given name exists. Flavors and images are answered from the catalog, other
+    # collections from the unique 'Name' index alone
+    def name_exists(self, collection, name):
+        if collection in Catalog.COLLECTIONS:
+            return self._catalog.exists(collection, name)
+        db = self.connection()
+        return db[collection].find_one({"Name": name}, {"_id": 0, "Name": 1}) is not None
+
+    # Returns the subset of names that belong to existing instances
+    def get_existing_instance_names(self, names):
+        db = self.connection()
+        instances = db["Instances"]
+        return [instance["Name"] for instance in instances.find({"Name": {"$in": list(names)}},
+                                                                {"_id": 0, "Name": 1})]
+
+    # Stores the instance document. Returns False if the unique 'Name' index already holds the name
+    def insert_instance(self, instance):
+        db = self.connection()
+        instances = db["Instances"]
+        try:
+            instances.insert_one(instance)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    # Delete instance from database
+    def delete_instance(self, name):
+        db = self.connection()
+        instances = db["Instances"]
+        instance = instances.find_one_and_delete({"Name": name}, {"_id": 0, "Server": 1, "Flavor": 1, "Resources": 1})
+        if instance is not None:
+            self.update_free_capacity(instance["Server"], self.instance_resources(instance), 1)
+
+    # Returns the list of all instance present in server. By default returns all instances in datacenter
+    def get_all_instances(self, server=None, fields=None, offset=0, limit=None):
+        db = self.connection()
+        instances = db["Instances"]
+        if server is not None:
+            result = instances.find({"Server": {"$in": server}}, _projection(fields))
+        else:
+            result = instances.find({}, _projection(fields))
+        return _page(result, offset, limit)
+
+    # Stores a Planner.Plan in one multi-document transaction. Stand-alone servers do not support transactions, so
+    # there the same bulk writes are sent without one
+    def apply_plan(self, plan):
+        try:
+            with self.client().start_session() as session:
+                session.with_transaction(lambda s: self._write_plan(plan, s))
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+            self._write_plan(plan)
+
+    # Writes a Planner.Plan with one unordered bulk write per collection. What can fail is written first: the names
+    # of the new instances are checked, then the server capacity is changed, each server that loses capacity only if
+    # it is still active and has it free (like reserve_capacity), then the rack caches, each only if no other command
+    # changed it since the plan read it. A conflict aborts the transaction. On a stand-alone server the capacity
+    # already changed is given back and the image lookups of the racks already written are stored, so the store stays
+    # consistent, and nothing else is written
+    def _write_plan(self, plan, session=None):
+        db = self.connection()
+        if plan.instances:
+            existing = db["Instances"].find_one({"Name": {"$in": [instance["Name"] for instance in plan.instances]}},
+                                                _projection(["Name"]), session=session)
+            if existing is not None:
+                raise Exception(exp.INSTANCE_ALREADY_EXISTS.format(existing["Name"]))
+        changed = self._write_plan_capacity(plan.server_deltas, session)
+        conflicts = self._write_plan_racks(plan.racks, session)
+        if conflicts:
+            if session is None:
+                self._undo_plan_capacity(plan.server_deltas, changed)
+                written = set(plan.racks) - set(conflicts)
+                self.update_lookups([pair for pair in plan.lookup_added if pair[1] in written],
+                                    [pair for pair in plan.lookup_removed if pair[1] in written])
+            raise Exception(exp.RACK_CACHE_CONFLICT.format(", ".join(conflicts)))
+        if plan.instances:
+            db["Instances"].insert_many(plan.instances, ordered=False, session=session)
+        if plan.moves:
+            db["Instances"].bulk_write([UpdateOne({"Name": name}, {"$set": {"Server": server}})
+                                        for name, server in plan.moves.items()], ordered=False, session=session)
+        if plan.deactivated:
+            db["Servers"].update_many({"Name": {"$in": plan.deactivated}}, {"$set": {"isActive": False}},
+                                      session=session)
+        if plan.deleted:
+            db["Servers"].delete_many({"Name": {"$in": plan.deleted}}, session=session)
+        self.update_lookups(plan.lookup_added, plan.lookup_removed, session)
+
+    # Adds the capacity deltas of the plan to the servers. Returns the names of the servers changed. Raises
+    # SERVER_CAPACITY_CONFLICT if a server that loses capacity is no longer active or no longer has it free; without a
+    # transaction the servers already changed are given back first
+    def _write_plan_capacity(self, deltas, session):
+        servers = self.connection()["Servers"]
+        updates = [(name, _capacity_query(name, delta), {"$inc": _capacity_change(delta, 1)})
+                   for name, delta in deltas.items()]
+        if not updates:
+            return []
+        if session is not None:
+            result = servers.bulk_write([UpdateOne(query, update) for name, query, update in updates], ordered=False,
+                                        session=session)
+            if result.matched_count != len(updates):
+                raise Exception(exp.SERVER_CAPACITY_CONFLICT)
+            return list(deltas)
+        changed = []
+        for name, query, update in updates:
+            if servers.update_one(query, update).matched_count != 1:
+                self._undo_plan_capacity(deltas, changed)
+                raise Exception(exp.SERVER_CAPACITY_CONFLICT)
+            changed.append(name)
+        return changed
+
+    def _undo_plan_capacity(self, deltas, changed):
+        servers = self.connection()["Servers"]
+        for name in changed:
+            servers.update_one({"Name": name}, {"$inc": _capacity_change(deltas[name], -1)})
+
+    # Stores the cache fields of the plan racks, each only if its CacheVersion is still the one read. Returns the
+    # names of the racks not written. In a transaction they are written with one bulk write, and a conflict writes
+    # none of them; without one they are written one by one, so that the racks written are known
+    def _write_plan_racks(self, racks, session):
+        collection = self.connection()["Racks"]
+        updates = [(name, _cache_version_query(name, rack.get("CacheVersion")),
+                    {"$set": RackCache.fields(rack), "$inc": {"CacheVersion": 1}})
+                   for name, rack in sorted(racks.items())]
+        if not updates:
+            return []
+        if session is not None:
+            result = collection.bulk_write([UpdateOne(query, update) for name, query, update in updates],
+                                           ordered=False, session=session)
+            return [] if result.matched_count == len(updates) else [name for name, query, update in updates]
+        return [name for name, query, update in updates if collection.update_one(query, update).matched_count != 1]
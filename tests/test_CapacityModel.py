@@ -0,0 +1,72 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import CapacityModel as capacity_model
+from CapacityModel import CapacityModel
+from Controller import Controller
+
+
+def server(n, memory, disk, vcpu, active=True):
+    return {"Name": "m{}".format(n), "Rack": "r{}".format(n % 10), "Memory_free": memory, "disk_free": disk,
+            "VCPU_free": vcpu, "isActive": active}
+
+
+def flavor(name, memory, disk, vcpu):
+    return {"Name": name, "Memory": memory, "Disk": disk, "VCPU": vcpu}
+
+
+# Headroom by placing the flavor with Controller.can_host on every active server until it no longer fits
+def brute_force(servers, flavor):
+    count = hosts = 0
+    for s in servers:
+        if not s["isActive"]:
+            continue
+        s = dict(s)
+        fits = 0
+        while Controller.can_host(flavor, s):
+            s["Memory_free"] -= flavor["Memory"]
+            s["disk_free"] -= flavor["Disk"]
+            s["VCPU_free"] -= flavor["VCPU"]
+            fits += 1
+        count += fits
+        hosts += fits > 0
+    return count, hosts
+
+
+class CapacityModelTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.servers = [server(n, rng.randint(0, 64), rng.randint(0, 32), rng.randint(0, 16), rng.random() > 0.1)
+                        for n in range(500)]
+        self.flavors = [flavor("f{}".format(n), rng.randint(1, 16), rng.randint(0, 8), rng.randint(1, 4))
+                        for n in range(20)]
+        self.flavors.append(flavor("huge", 1000, 1000, 1000))
+
+    def check_headroom(self):
+        model = CapacityModel(self.servers)
+        self.assertEqual(model.headroom(self.flavors), [brute_force(self.servers, f) for f in self.flavors])
+
+    def test_headroom_matches_brute_force(self):
+        self.check_headroom()
+
+    def test_headroom_without_numpy_matches_brute_force(self):
+        numpy = capacity_model.numpy
+        capacity_model.numpy = None
+        try:
+            self.check_headroom()
+        finally:
+            capacity_model.numpy = numpy
+
+    def test_flavor_without_resources_has_no_limit(self):
+        model = CapacityModel(self.servers)
+        active = sum(s["isActive"] for s in self.servers)
+        self.assertEqual(model.headroom([flavor("empty", 0, 0, 0)]), [(None, active)])
+
+
+if __name__ == "__main__":
+    unittest.main()
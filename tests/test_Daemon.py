@@ -0,0 +1,66 @@
+import json
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Daemon
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon_end, self.client_end = socket.socketpair()
+        self.client = self.client_end.makefile("r", encoding="utf-8")
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon_end.close()
+        self.client_end.close()
+
+    def frame(self):
+        return json.loads(self.client.readline())
+
+    def test_output_is_sent_while_the_command_runs(self):
+        received = []
+
+        def execute(argv):
+            print("first line")
+            received.append(self.frame())
+            sys.stdout.write("partial")
+            print(" line")
+            return True
+
+        ok = Daemon._run(execute, {"argv": []}, Daemon._Stream(self.daemon_end))
+        self.assertTrue(ok)
+        self.assertEqual(received, [{"output": "first line\n"}])
+        self.assertEqual(self.frame(), {"output": "partial line\n"})
+
+    def test_error_is_sent_and_command_fails(self):
+        def execute(argv):
+            sys.stdout.write("no newline")
+            raise Exception("broken")
+
+        ok = Daemon._run(execute, {"argv": []}, Daemon._Stream(self.daemon_end))
+        self.assertFalse(ok)
+        self.assertEqual(self.frame(), {"output": "no newlinebroken\n"})
+
+    def test_command_finishes_when_client_is_gone(self):
+        self.client.close()
+        self.client_end.close()
+        finished = []
+
+        def execute(argv):
+            for line in range(1000):
+                print("line {}".format(line))
+            finished.append(True)
+            return True
+
+        self.assertTrue(Daemon._run(execute, {"argv": []}, Daemon._Stream(self.daemon_end)))
+        self.assertEqual(finished, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PlacementIndex import PlacementIndex
+
+SERVERS = 20000
+
+
+def server(n, memory, disk, vcpu):
+    return {"Name": "m{}".format(n), "Rack": "r{}".format(n % 100), "Memory_free": memory, "disk_free": disk,
+            "VCPU_free": vcpu, "isActive": True}
+
+
+# Best fit by comparing every server
+def brute_force(servers, memory, disk, vcpu):
+    fits = [(s["Memory_free"], s["disk_free"], s["VCPU_free"], s["Name"]) for s in servers
+            if s["Memory_free"] >= memory and s["disk_free"] >= disk and s["VCPU_free"] >= vcpu]
+    return min(fits)[3] if fits else None
+
+
+# Counts the servers a query looks at, which does not depend on the speed of the machine
+class PlacementIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.servers = [server(n, rng.randint(1, 1000), rng.randint(1, 1000), rng.randint(1, 1000))
+                        for n in range(SERVERS)]
+        self.index = PlacementIndex(self.servers)
+
+    def assert_scans_few(self, memory, disk, vcpu, limit):
+        self.assertEqual(self.index.best_fit(memory, disk, vcpu), brute_force(self.servers, memory, disk, vcpu))
+        self.assertLessEqual(self.index.scanned, limit)
+
+    def test_scarce_memory(self):
+        self.assert_scans_few(999, 1, 1, SERVERS // 100)
+
+    def test_scarce_disk(self):
+        self.assert_scans_few(1, 999, 1, SERVERS // 100)
+
+    def test_scarce_vcpu(self):
+        self.assert_scans_few(1, 1, 999, SERVERS // 100)
+
+    def test_nothing_scarce(self):
+        self.assert_scans_few(10, 10, 10, 10)
+
+    def test_all_scarce(self):
+        self.assert_scans_few(950, 950, 950, SERVERS // 10)
+
+    def test_random_queries_match_brute_force(self):
+        rng = random.Random(1)
+        for query in range(200):
+            memory, disk, vcpu = rng.randint(1, 1000), rng.randint(1, 1000), rng.randint(1, 1000)
+            self.assertEqual(self.index.best_fit(memory, disk, vcpu),
+                             brute_force(self.servers, memory, disk, vcpu))
+            self.assertLess(self.index.scanned, SERVERS // 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
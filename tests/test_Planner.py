@@ -0,0 +1,60 @@
+import itertools
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Planner import Planner
+
+
+def server(name, memory, disk, vcpu):
+    return {"Name": name, "Memory_free": memory, "disk_free": disk, "VCPU_free": vcpu}
+
+
+# Returns True if the assignment keeps every server within its free resources
+def fits(demands, candidates, assignment):
+    free = dict((s["Name"], [s["Memory_free"], s["disk_free"], s["VCPU_free"]]) for s in candidates)
+    for demand, name in zip(demands, assignment):
+        for r in range(3):
+            free[name][r] -= demand[r]
+    return all(min(resources) >= 0 for resources in free.values())
+
+
+class ExactFitTest(unittest.TestCase):
+
+    def test_infeasible_on_large_fleet_returns_quickly(self):
+        rng = random.Random(0)
+        candidates = [server("big-{}".format(n), 16 + rng.randint(0, 15), 100, 100) for n in range(9)]
+        candidates += [server("small-{}".format(n), rng.randint(1, 15), 100, 100) for n in range(10000)]
+        demands = [(16 + n % 3, 2, 4) for n in range(10)]
+        started = time.perf_counter()
+        self.assertIsNone(Planner.exact_fit(demands, candidates))
+        self.assertLess(time.perf_counter() - started, 2)
+
+    def test_equal_demands_on_fragmented_servers_return_quickly(self):
+        candidates = [server("big-{}".format(n), 31, 8, 16) for n in range(9)]
+        candidates += [server("small-{}".format(n), 8, 1, 2) for n in range(10000)]
+        started = time.perf_counter()
+        self.assertIsNone(Planner.exact_fit([(16, 2, 4)] * 10, candidates))
+        self.assertLess(time.perf_counter() - started, 2)
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        for case in range(300):
+            candidates = [server("s{}".format(n), rng.randint(0, 16), rng.randint(0, 8), rng.randint(0, 8))
+                          for n in range(rng.randint(1, 4))]
+            demands = [(rng.choice([2, 4, 8]), rng.choice([1, 2, 4]), rng.choice([1, 2, 4]))
+                       for n in range(rng.randint(1, 4))]
+            feasible = any(fits(demands, candidates, [candidates[c]["Name"] for c in combination])
+                           for combination in itertools.product(range(len(candidates)), repeat=len(demands)))
+            assignment = Planner.exact_fit(demands, candidates)
+            self.assertEqual(assignment is not None, feasible)
+            if assignment is not None:
+                self.assertTrue(fits(demands, candidates, assignment))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DAO as dao
+from Controller import Controller
+from Scheduler import Scheduler
+from storage.MemoryBackend import MemoryBackend
+
+RACKS = 8
+SERVERS_PER_RACK = 5
+
+
+# Loads RACKS racks of SERVERS_PER_RACK servers, two images and one flavor into an empty memory backend
+def load_data_center():
+    dao.use_backend(MemoryBackend())
+    dao.initialize()
+    with tempfile.TemporaryDirectory() as directory:
+        hardware = os.path.join(directory, "hdwr-config.txt")
+        with open(hardware, "w") as f:
+            f.write("{}\n".format(RACKS))
+            for r in range(RACKS):
+                f.write("r{} 10000\n".format(r))
+            f.write("{}\n".format(RACKS * SERVERS_PER_RACK))
+            for s in range(RACKS * SERVERS_PER_RACK):
+                f.write("s{} r{} 10.0.0.{} 64 64 16\n".format(s, s % RACKS, s))
+        images = os.path.join(directory, "image-config.txt")
+        with open(images, "w") as f:
+            f.write("3\nimg-a 100 /a.img\nimg-b 100 /b.img\nimg-c 100 /c.img\n")
+        flavors = os.path.join(directory, "flavor-config.txt")
+        with open(flavors, "w") as f:
+            f.write("1\nsmall 1 1 1\n")
+        Controller.create_racks_servers(hardware)
+        Controller.create_images(images)
+        Controller.create_flavors(flavors)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        load_data_center()
+
+    def test_overlapping_racks_form_one_group(self):
+        dao.update_lookup("img-a", "r0")
+        dao.update_lookup("img-a", "r1")
+        dao.update_lookup("img-b", "r1")
+        dao.update_lookup("img-b", "r2")
+        requests = [("a", "img-a", "small"), ("b", "img-b", "small"), ("c", "img-c", "small")]
+        groups = Scheduler.affinity_groups(list(enumerate(requests)))
+        self.assertEqual(sorted((racks, [item[0] for item in items]) for racks, items in groups.values()),
+                         [([], [2]), (["r0", "r1", "r2"], [0, 1])])
+
+    def test_workers_place_on_their_own_racks(self):
+        requests = [("vm-{}".format(n), "img-a", "small") for n in range(2000)]
+        scheduler = Scheduler(4)
+        report = scheduler.run(requests)
+        instances = list(dao.get_all_instances())
+        self.assertEqual(len(instances), report["Summary"]["Created"])
+        racks = [rack for worker_racks in scheduler.racks for rack in worker_racks]
+        self.assertEqual(sorted(racks), sorted(dao.get_valid_racks()))
+        rack_of = dict((server["Name"], server["Rack"]) for server in dao.get_all_servers())
+        for worker in range(scheduler.workers):
+            for server in scheduler.servers[worker]:
+                self.assertIn(rack_of[server], scheduler.racks[worker])
+        self.assertGreater(len(set(instance["Server"] for instance in instances)), 2)
+        for server in dao.get_all_servers():
+            self.assertGreaterEqual(min(server["Memory_free"], server["disk_free"], server["VCPU_free"]), 0)
+
+    def test_no_more_workers_than_racks(self):
+        scheduler = Scheduler(RACKS * 2)
+        scheduler.run([("vm-{}".format(n), "img-b", "small") for n in range(10)])
+        self.assertEqual(scheduler.workers, RACKS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DAO as dao
+from Controller import Controller
+from Simulator import Simulator
+from storage.MemoryBackend import MemoryBackend
+
+
+# Loads two racks of two servers, one image and one flavor into an empty memory backend
+def load_data_center(directory):
+    dao.use_backend(MemoryBackend())
+    dao.initialize()
+    hardware = os.path.join(directory, "hdwr-config.txt")
+    with open(hardware, "w") as f:
+        f.write("2\nr0 1000\nr1 1000\n4\n")
+        for s in range(4):
+            f.write("s{} r{} 10.0.0.{} 16 16 4\n".format(s, s % 2, s))
+    images = os.path.join(directory, "image-config.txt")
+    with open(images, "w") as f:
+        f.write("1\nimg 100 /img.img\n")
+    flavors = os.path.join(directory, "flavor-config.txt")
+    with open(flavors, "w") as f:
+        f.write("1\nsmall 1 1 1\n")
+    Controller.create_racks_servers(hardware)
+    Controller.create_images(images)
+    Controller.create_flavors(flavors)
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        load_data_center(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def simulate(self, trace):
+        file_name = os.path.join(self.directory.name, "trace.txt")
+        with open(file_name, "w") as f:
+            f.write(trace)
+        return Simulator().run(file_name)
+
+    def test_unknown_names_are_failed_events(self):
+        report = self.simulate("create a small img\n"
+                               "create b large img\n"
+                               "create c small missing-img\n"
+                               "evacuate r9\n"
+                               "create d small img\n")
+        summary = report["Summary"]
+        self.assertEqual(summary["Events"], 5)
+        self.assertEqual(summary["Creates"], 4)
+        self.assertEqual(summary["Placed"], 2)
+        self.assertEqual(summary["CreateFailures"], 2)
+        self.assertEqual(summary["Evacuations"], 1)
+        self.assertEqual(summary["MigrationFailures"], 1)
+        self.assertEqual(len(report["Failures"]), 3)
+        self.assertIn('"large"', report["Failures"][0])
+        self.assertIn('"missing-img"', report["Failures"][1])
+        self.assertIn('"r9"', report["Failures"][2])
+
+    def test_malformed_line_stops_the_run(self):
+        with self.assertRaises(Exception):
+            self.simulate("create a small img\nlaunch b\n")
+
+
+if __name__ == "__main__":
+    unittest.main()